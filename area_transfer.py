@@ -0,0 +1,47 @@
+import pandas as pd
+
+from compute_overlay import OVERLAY_VERSION, process_overlay
+from data_processing import boundary_keys, read_cache, write_cache
+
+
+def transfer_table(overlay):
+    # square metres of each year's constituency that lie in each other_year constituency,
+    # for every ordered year pair; touching-only neighbours (zero area) are dropped
+    table = pd.DataFrame(overlay.drop(columns="geometry")).reset_index(drop=True)
+    return table[table["area"] > 0].reset_index(drop=True)
+
+
+def transfer_matrix(transfers, year, other_year):
+    # N x M matrix of square metres: rows are `year` constituencies, columns are `other_year` ones
+    pair = transfers[
+        (transfers["year"] == year) & (transfers["other_year"] == other_year)
+    ]
+    return pair.pivot_table(
+        index="ED_DESC",
+        columns="other_ED_DESC",
+        values="area",
+        aggfunc="sum",
+        fill_value=0.0,
+    )
+
+
+def process_transfers(overlay=None, use_cache=True):
+    hashes = boundary_keys()
+    hashes["overlay"] = OVERLAY_VERSION
+
+    if use_cache:
+        transfers = read_cache("transfers", hashes, geo=False)
+        if transfers is not None:
+            return transfers
+
+    if overlay is None:
+        overlay = process_overlay()
+
+    transfers = transfer_table(overlay)
+    write_cache(transfers, "transfers", hashes)
+
+    return transfers
+
+
+if __name__ == "__main__":
+    process_transfers(use_cache=False)
@@ -0,0 +1,192 @@
+import argparse
+import itertools
+import json
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+from area_transfer import process_transfers
+from compute_overlay import process_overlay
+from boundary_store import BoundaryStore
+from data_processing import process
+from lineage import Lineage
+from simplify_boundaries import process_simplified, simplified_frame, tolerance_for_zoom
+from topology import process_topology
+from views import COMPARE_TYPES, build_view, render_map
+
+# per-process state, loaded once by each worker from the on-disk caches
+state = {}
+
+
+def load_state():
+    gdf = process()
+    lod = process_simplified(gdf)
+    state["gdf"] = gdf
+    state["overlay"] = process_overlay(gdf)
+    state["lineage"] = Lineage(process_transfers(state["overlay"]))
+    state["display"] = {
+        zoom: BoundaryStore(simplified_frame(lod, tolerance_for_zoom(zoom)))
+        for zoom in [11, 12]
+    }
+    state["topology"] = process_topology(tolerance_for_zoom(11), gdf)
+
+
+def list_jobs(gdf):
+    years = sorted(gdf["year"].unique())
+    constituencies = sorted(gdf["ED_DESC"].unique())
+
+    jobs = []
+    for baseline_year, compare_year in itertools.product(years, years):
+        for compare_type in COMPARE_TYPES:
+            if compare_type == "Full Map":
+                jobs.append((baseline_year, compare_year, compare_type, None))
+            else:
+                jobs.extend(
+                    (baseline_year, compare_year, compare_type, constituency)
+                    for constituency in constituencies
+                )
+    return jobs
+
+
+def slug(job):
+    baseline_year, compare_year, compare_type, constituency = job
+    parts = [baseline_year, compare_year, compare_type, constituency or "all"]
+    return "_".join(
+        part.lower().replace(" - ", "-").replace(" ", "-") for part in parts
+    )
+
+
+def write_layers(spec, path):
+    # all layers of one map as a single static file; topologies are kept as TopoJSON
+    for item in spec["layers"]:
+        if item["topology_object"] is not None:
+            path = path + ".topojson"
+            with open(path, "w") as f:
+                json.dump(item["data"], f, separators=(",", ":"))
+            return path
+
+    features = []
+    for item in spec["layers"]:
+        layer_json = json.loads(item["data"].to_json(drop_id=True))
+        for feature in layer_json["features"]:
+            feature["properties"]["layer"] = item["kwargs"].get("name")
+            feature["properties"]["color"] = item["kwargs"].get("color")
+        features.extend(layer_json["features"])
+
+    path = path + ".geojson"
+    with open(path, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
+    return path
+
+
+def render_job(job, output, tiles):
+    if not state:
+        load_state()
+
+    baseline_year, compare_year, compare_type, constituency = job
+    zoom = 11 if compare_type == "Full Map" else 12
+    panels = build_view(
+        state["display"][zoom],
+        state["overlay"],
+        state["lineage"],
+        state["topology"],
+        baseline_year,
+        compare_year,
+        compare_type,
+        constituency,
+    )
+
+    directory = os.path.join(output, slug(job))
+    os.makedirs(directory, exist_ok=True)
+
+    entry = {
+        "baseline_year": baseline_year,
+        "compare_year": compare_year,
+        "compare_type": compare_type,
+        "constituency": constituency,
+        "panels": [],
+    }
+    for side, panel in zip(["left", "right"], panels):
+        artifact = {"text": panel["text"], "html": None, "data": None}
+        if panel["map"]:
+            html_path = os.path.join(directory, side + ".html")
+            render_map(panel["map"], tiles).save(html_path)
+            data_path = write_layers(panel["map"], os.path.join(directory, side))
+            artifact["html"] = os.path.relpath(html_path, output)
+            artifact["data"] = os.path.relpath(data_path, output)
+        entry["panels"].append(artifact)
+
+    return entry
+
+
+def write_index(entries, output):
+    with open(os.path.join(output, "index.json"), "w") as f:
+        json.dump(entries, f, indent=2)
+
+    rows = []
+    for entry in entries:
+        links = " | ".join(
+            (
+                '<a href="{}">{}</a>'.format(panel["html"], panel["text"])
+                if panel["html"]
+                else panel["text"]
+            )
+            for panel in entry["panels"]
+        )
+        rows.append(
+            "<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>".format(
+                entry["baseline_year"],
+                entry["compare_year"],
+                entry["compare_type"],
+                entry["constituency"] or "",
+                links,
+            )
+        )
+
+    with open(os.path.join(output, "index.html"), "w") as f:
+        f.write(
+            "<html><body><table>"
+            "<tr><th>Baseline</th><th>Compare</th><th>Type</th><th>Constituency</th><th>Maps</th></tr>"
+            "{}</table></body></html>".format("".join(rows))
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render every (baseline, compare, constituency, mode) combination to static files."
+    )
+    parser.add_argument("--output", default="output")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--tiles", default="CartoDB positron")
+    args = parser.parse_args()
+
+    # centroid-in-geographic-CRS and tile API key warnings repeat for every map
+    warnings.simplefilter("ignore", UserWarning)
+
+    # build the caches once in the parent so workers only read them
+    load_state()
+    jobs = list_jobs(state["gdf"])
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        entries = list(
+            executor.map(
+                render_job,
+                jobs,
+                itertools.repeat(args.output),
+                itertools.repeat(args.tiles),
+                chunksize=16,
+            )
+        )
+
+    write_index(entries, args.output)
+    print(
+        "rendered {} combinations in {:.1f}s".format(
+            len(entries), time.perf_counter() - start
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
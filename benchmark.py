@@ -0,0 +1,597 @@
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import platform
+import os
+import subprocess
+import tempfile
+import time
+import urllib.request
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from area_transfer import process_transfers
+from boundary_store import BoundaryStore
+from compact_geojson import COORDINATE_PRECISION
+from compactness import process_compactness
+from compute_intersection import compute_intersect
+from compute_overlay import compute_overlay, process_overlay
+from data_processing import (
+    build,
+    description_attributes,
+    ed_desc,
+    process,
+    read_boundaries,
+)
+from kml_reader import read_kml
+from lineage import Lineage
+from precision import PRECISION_GRID, normalize_geometries, overlap_area
+from simplify_boundaries import (
+    TOLERANCES,
+    process_simplified,
+    simplified_frame,
+    simplify_boundaries,
+    tolerance_for_zoom,
+)
+from topology import build_topology, process_topology, subset_topology
+from vector_tiles import (
+    boundaries_name,
+    build_tileset,
+    process_tiles,
+    start_tile_server,
+)
+from views import (
+    COMPARE_TYPES,
+    INFO_COLUMNS,
+    LINEAGE_MIN_SHARE,
+    build_view,
+    layer,
+    map_spec,
+    render_map,
+    render_panels,
+    rendered_size,
+)
+
+
+def best_of(func, repeat=5):
+    # best wall-clock time in seconds over a few runs
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def bench_description_parsing(repeat=5):
+    # per-row BeautifulSoup parsing vs the batch regex extractor on the 2006/2011/2015 descriptions
+    descriptions = pd.concat(
+        [
+            gpd.read_file(
+                "data/ElectoralBoundary{}GEOJSON.geojson".format(y),
+                ignore_geometry=True,
+            )["Description"]
+            for y in ["2006", "2011", "2015"]
+        ],
+        ignore_index=True,
+    )
+
+    expected = descriptions.apply(ed_desc)
+    assert expected.equals(description_attributes(descriptions)["ED_DESC"])
+
+    apply_time = best_of(lambda: descriptions.apply(ed_desc), repeat)
+    batch_time = best_of(lambda: description_attributes(descriptions), repeat)
+
+    return {
+        "rows": len(descriptions),
+        "apply_ed_desc_s": apply_time,
+        "description_attributes_s": batch_time,
+        "speedup": apply_time / batch_time,
+    }
+
+
+def bench_simplification():
+    # GeoJSON bytes of one full-map layer per year, before and after simplification
+    lod = process_simplified(process())
+    results = {}
+    for tolerance in TOLERANCES:
+        frame = simplified_frame(lod, tolerance)
+        for year in sorted(frame["year"].unique()):
+            results["geojson_{}_tol{}m_bytes".format(year, tolerance)] = len(
+                frame[frame["year"] == year].to_json()
+            )
+    return results
+
+
+def bench_topology():
+    # shared-arc TopoJSON bytes: all four years together, and one full-map layer per year
+    gdf = process()
+    results = {}
+    for tolerance in TOLERANCES:
+        topology = process_topology(tolerance, gdf)
+        results["topojson_all_years_tol{}m_bytes".format(tolerance)] = len(
+            json.dumps(topology)
+        )
+        for year in topology["objects"]:
+            results["topojson_{}_tol{}m_bytes".format(year, tolerance)] = len(
+                json.dumps(subset_topology(topology, year))
+            )
+    return results
+
+
+def read_kmz_boundaries():
+    # the KMZ holds the 2020 boundaries only
+    return read_kml("data/ElectoralBoundaryDataset.kmz")
+
+
+SOURCE_READERS = {
+    "geojson": lambda: read_boundaries("geojson"),
+    "kml": lambda: read_boundaries("kml"),
+    "kmz_2020": read_kmz_boundaries,
+}
+
+
+def peak_rss():
+    # the process's resident high-water mark since the last reset_peak_rss
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return 1024 * int(line.split()[1])
+
+
+def reset_peak_rss():
+    # linux only: restart the high-water mark from the current RSS; ru_maxrss cannot be
+    # reset, and in a spawned worker it already covers the imports and the parent's peak
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+
+def measure_source(source, repeat):
+    # run in a fresh process: peak RSS growth of the first read, peak Python heap
+    # (tracemalloc, which does not see GDAL's own allocations), then best time
+    read = SOURCE_READERS[source]
+
+    reset_peak_rss()
+    rss_before = peak_rss()
+    read()
+    rss_after = peak_rss()
+
+    tracemalloc.start()
+    read()
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "s": best_of(read, repeat),
+        "peak_rss_growth_bytes": rss_after - rss_before,
+        "tracemalloc_peak_bytes": traced_peak,
+    }
+
+
+def bench_sources(repeat=3):
+    # reading the boundary files per source format, each in its own fresh process
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for source in SOURCE_READERS:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            measured = executor.submit(measure_source, source, repeat).result()
+        for key, value in measured.items():
+            results["{}_{}".format(source, key)] = value
+    return results
+
+
+def bench_process(repeat=3):
+    # full rebuild from the source files vs loading the on-disk cache
+    process()
+    return {
+        "build_s": best_of(build, repeat),
+        "cached_s": best_of(process, repeat),
+    }
+
+
+def bench_serialization(repeat=3):
+    # rendered HTML bytes and build+render time per constituency view, with folium's own
+    # GeoJSON conversion vs the compact serializer; 2015 vs 2020 for every 2015 constituency
+    gdf = process()
+    overlay = process_overlay(gdf)
+    lod = process_simplified(gdf)
+    store = BoundaryStore(simplified_frame(lod, tolerance_for_zoom(12)))
+    topology = process_topology(tolerance_for_zoom(11), gdf)
+    lineage = Lineage(process_transfers(overlay))
+
+    def render(panels, precision):
+        return [
+            render_map(panel["map"], "OpenStreetMap", precision).get_root().render()
+            for panel in panels
+            if panel["map"]
+        ]
+
+    results = {}
+    for compare_type in COMPARE_TYPES[1:]:
+        views = [
+            build_view(
+                store,
+                overlay,
+                lineage,
+                topology,
+                "2015",
+                "2020",
+                compare_type,
+                constituency,
+            )
+            for constituency in sorted(store.year_frame("2015")["ED_DESC"].unique())
+        ]
+        name = compare_type.lower().replace(" ", "_")
+        for label, precision in [("folium", None), ("compact", COORDINATE_PRECISION)]:
+            results["{}_{}_bytes_per_view".format(name, label)] = np.mean(
+                [
+                    sum(len(html.encode()) for html in render(v, precision))
+                    for v in views
+                ]
+            )
+            results["{}_{}_s_per_view".format(name, label)] = best_of(
+                lambda: [render(v, precision) for v in views], repeat
+            ) / len(views)
+    return results
+
+
+def bench_vector_tiles(repeat=3):
+    # building the whole tile archive from scratch, its size, serving one tile, and the
+    # full-map page with the boundaries embedded vs drawn from tiles
+    gdf = process()
+    overlay = process_overlay(gdf)
+    compactness = process_compactness(gdf)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "tiles.mbtiles")
+        start = time.perf_counter()
+        process_tiles(gdf, overlay, compactness, path)
+        results = {
+            "build_s": time.perf_counter() - start,
+            "archive_bytes": os.path.getsize(path),
+            "tiles_per_year": sum(
+                1 for _ in build_tileset("b", gdf[gdf["year"] == "2020"], ["ED_DESC"])
+            ),
+        }
+
+        tile_url = start_tile_server(path)
+        url = tile_url.format(tileset=boundaries_name("2020")).format(
+            z=12, x=3229, y=2031
+        )
+        results["serve_tile_s"] = best_of(
+            lambda: urllib.request.urlopen(url).read(), repeat * 10
+        )
+
+        store = BoundaryStore(gdf)
+        lineage = Lineage(process_transfers(overlay))
+        topology = process_topology(tolerance_for_zoom(11), gdf)
+        for label, view_tile_url in [("embedded", None), ("tiles", tile_url)]:
+            panels = build_view(
+                store,
+                overlay,
+                lineage,
+                topology,
+                "2015",
+                "2020",
+                "Full Map",
+                None,
+                tile_url=view_tile_url,
+            )
+            results["full_map_{}_bytes".format(label)] = rendered_size(
+                render_panels(panels, "OpenStreetMap")
+            )
+
+    return results
+
+
+def bench_precision(repeat=3):
+    # the raw boundaries against the grid-snapped ones: vertices, geometry bytes, the
+    # intersects predicate with and without persistent preparation, and how far the
+    # overlay moves
+    raw = read_boundaries("geojson")
+    normalized = raw.set_geometry(normalize_geometries(raw.geometry))
+
+    results = {"grid_m": PRECISION_GRID}
+    for label, gdf in [("raw", raw), ("normalized", normalized)]:
+        geometry = np.asarray(gdf.geometry.values)
+        results["{}_vertices".format(label)] = int(
+            shapely.get_num_coordinates(geometry).sum()
+        )
+        # 8 bytes per ordinate; the source files carry a z of 0 on every vertex
+        results["{}_coordinate_bytes".format(label)] = int(
+            8
+            * (
+                shapely.get_num_coordinates(geometry)
+                * np.where(shapely.has_z(geometry), 3, 2)
+            ).sum()
+        )
+        results["{}_wkb_bytes".format(label)] = sum(
+            len(wkb) for wkb in shapely.to_wkb(geometry)
+        )
+        results["{}_invalid".format(label)] = int((~shapely.is_valid(geometry)).sum())
+
+    # area where two constituencies of the same year overlap, in SVY21 where the snapping
+    # is done; converting back to degrees moves vertices off their neighbours' edges
+    for year, frame in raw.to_crs(3414).groupby("year"):
+        results["raw_{}_overlap_m2".format(year)] = overlap_area(frame.geometry)
+        results["normalized_{}_overlap_m2".format(year)] = overlap_area(
+            normalize_geometries(frame.geometry)
+        )
+
+    # the intersects predicate on 2015 constituencies against 2020 ones, as compute_intersect
+    # and the overlay use it, and on points as point_lookup does: through the tree (GEOS
+    # prepares each query geometry), on envelope candidates with plain geometries, and on
+    # envelope candidates with geometries prepared once up front
+    geometry = np.asarray(normalized.geometry.values)
+    years = normalized["year"].to_numpy()
+    polygons = geometry[years == "2015"]
+    others = geometry[years == "2020"]
+    tree = shapely.STRtree(others)
+    rng = np.random.default_rng(0)
+    x0, y0, x1, y1 = shapely.total_bounds(others)
+    points = shapely.points(rng.uniform(x0, x1, 20000), rng.uniform(y0, y1, 20000))
+
+    for label, queries in [("polygons", polygons), ("points", points)]:
+        query_idx, other_idx = tree.query(queries)
+        plain = shapely.from_wkb(shapely.to_wkb(others))
+        prepared = shapely.from_wkb(shapely.to_wkb(others))
+        shapely.prepare(prepared)
+
+        results["{}_intersects_tree_s".format(label)] = best_of(
+            lambda: tree.query(queries, predicate="intersects"), repeat
+        )
+        for name, candidates in [("plain", plain), ("prepared", prepared)]:
+            results["{}_intersects_{}_s".format(label, name)] = best_of(
+                lambda: shapely.intersects(candidates[other_idx], queries[query_idx]),
+                repeat,
+            )
+
+    # fragment shares of the overlay before and after, on the same (year, ED) pairs
+    keys = ["year", "ED_DESC", "other_year", "other_ED_DESC"]
+    before = compute_overlay(raw)
+    after = compute_overlay(normalized)
+    merged = before[keys + ["area", "share"]].merge(
+        after[keys + ["area", "share"]], on=keys, how="outer", suffixes=("_raw", "")
+    )
+    results["overlay_fragments_raw"] = len(before)
+    results["overlay_fragments_normalized"] = len(after)
+    results["overlay_max_share_diff"] = float(
+        (merged["share"].fillna(0) - merged["share_raw"].fillna(0)).abs().max()
+    )
+    results["overlay_max_area_diff_m2"] = float(
+        (merged["area"].fillna(0) - merged["area_raw"].fillna(0)).abs().max()
+    )
+    return results
+
+
+def bench_lineage(repeat=3):
+    # finding the other-year constituencies of a constituency missing from that year:
+    # the old scaled-centroid intersection vs a lookup in the precomputed lineage graph
+    gdf = process()
+    store = BoundaryStore(gdf)
+    lineage = Lineage(process_transfers())
+
+    cases = [
+        (year, other_year, constituency)
+        for year, other_year in itertools.permutations(store.years, 2)
+        for constituency in store.constituencies
+        if len(store.constituency_frame(year, constituency))
+        and not len(store.constituency_frame(other_year, constituency))
+    ]
+
+    def heuristic():
+        for year, other_year, constituency in cases:
+            compute_intersect(
+                store.year_frame(other_year),
+                store.constituency_frame(year, constituency),
+                constituency,
+            )
+
+    def graph():
+        for year, other_year, constituency in cases:
+            lineage.related(year, constituency, other_year, LINEAGE_MIN_SHARE)
+
+    return {
+        "lookups": len(cases),
+        "build_s": best_of(lambda: Lineage(process_transfers()), repeat),
+        "compute_intersect_s": best_of(heuristic, repeat),
+        "lineage_s": best_of(graph, repeat),
+    }
+
+
+def worker_counts():
+    # 1, 2, 4, ... up to and including every core
+    cores = os.cpu_count() or 1
+    return sorted({2**i for i in range(cores.bit_length()) if 2**i <= cores} | {cores})
+
+
+def bench_overlay_workers(gdf, workers, repeat=3):
+    # full-matrix overlay across 1..N workers in threads and in processes, with the speedup
+    # over one worker and a check that every run matches the serial rows exactly
+    serial = compute_overlay(gdf, workers=1)
+    serial_wkb = shapely.to_wkb(serial.geometry.values)
+
+    results = {"features": len(gdf), "cores": os.cpu_count()}
+    for executor in ["thread", "process"]:
+        curve = []
+        for count in workers:
+            overlay = compute_overlay(gdf, count, executor)
+            identical = serial.drop(columns="geometry").equals(
+                overlay.drop(columns="geometry")
+            ) and bool((shapely.to_wkb(overlay.geometry.values) == serial_wkb).all())
+            curve.append(
+                {
+                    "workers": count,
+                    "s": best_of(lambda: compute_overlay(gdf, count, executor), repeat),
+                    "identical": identical,
+                }
+            )
+        for point in curve:
+            point["speedup"] = curve[0]["s"] / point["s"]
+        results[executor] = curve
+    return results
+
+
+def synthetic_boundaries(gdf, factor):
+    # split every constituency on an n x n grid and densify the pieces, giving roughly `factor`
+    # times the features and vertices while keeping each year a gap-free coverage
+    n = math.ceil(math.sqrt(factor))
+    projected = gdf.reset_index(drop=True).to_crs(3414)
+    geometry = np.asarray(projected.geometry.values)
+
+    xmin, ymin, xmax, ymax = shapely.bounds(geometry).T
+    steps = np.arange(n) / n
+    cell_x = xmin[:, None] + (xmax - xmin)[:, None] * steps
+    cell_y = ymin[:, None] + (ymax - ymin)[:, None] * steps
+    width = ((xmax - xmin) / n)[:, None, None]
+    height = ((ymax - ymin) / n)[:, None, None]
+
+    x0 = np.broadcast_to(cell_x[:, :, None], (len(gdf), n, n))
+    y0 = np.broadcast_to(cell_y[:, None, :], (len(gdf), n, n))
+    cells = shapely.box(x0, y0, x0 + width, y0 + height).reshape(len(gdf), -1)
+
+    pieces = shapely.intersection(geometry[:, None], cells)
+    parent, cell = np.nonzero(~shapely.is_empty(pieces) & (shapely.area(pieces) > 0))
+    pieces = pieces[parent, cell]
+
+    # densify so the vertex count grows by about the same factor as the feature count
+    target = factor * shapely.get_num_coordinates(geometry).sum()
+    pieces = shapely.segmentize(pieces, shapely.length(pieces).sum() / target)
+
+    synthetic = projected.drop(columns="geometry").iloc[parent].reset_index(drop=True)
+    synthetic["ED_DESC"] = synthetic["ED_DESC"] + " " + cell.astype(str)
+    return gpd.GeoDataFrame(synthetic, geometry=pieces, crs=3414).to_crs(gdf.crs)
+
+
+def bench_stages(gdf, repeat=3):
+    # time each pipeline stage on one dataset
+    years = sorted(gdf["year"].unique())
+    baseline_year, compare_year = years[-2], years[-1]
+    gdf_baseline_all = gdf[gdf["year"] == baseline_year].reset_index(drop=True)
+    gdf_compare_all = gdf[gdf["year"] == compare_year].reset_index(drop=True)
+
+    # constituency info merge, as at the end of data_processing.build()
+    info = gdf[INFO_COLUMNS].drop_duplicates(["year", "ED_DESC"])
+    boundaries = gdf[["year", "ED_DESC", "geometry"]]
+
+    # compute_intersect for a fixed sample of selections
+    sample = (
+        gdf_baseline_all["ED_DESC"]
+        .iloc[np.linspace(0, len(gdf_baseline_all) - 1, 20).astype(int)]
+        .unique()
+    )
+
+    def intersect_sample():
+        for constituency in sample:
+            gdf_single = gdf_baseline_all[
+                gdf_baseline_all["ED_DESC"] == constituency
+            ].reset_index(drop=True)
+            compute_intersect(gdf_compare_all, gdf_single, constituency)
+
+    # folium construction and HTML rendering of one full-map layer
+    def full_map():
+        spec = map_spec(gdf_compare_all, [layer(gdf_compare_all)], "bench", 11)
+        return render_map(spec, "OpenStreetMap").get_root().render()
+
+    return {
+        "features": len(gdf),
+        "vertices": int(shapely.get_num_coordinates(gdf.geometry.values).sum()),
+        "merge_s": best_of(
+            lambda: boundaries.merge(info, how="left", on=["year", "ED_DESC"]), repeat
+        ),
+        "compute_intersect_s": best_of(intersect_sample, repeat),
+        "compute_intersect_calls": len(sample),
+        "compute_overlay_s": best_of(lambda: compute_overlay(gdf), repeat),
+        "simplify_20m_s": best_of(lambda: simplify_boundaries(gdf, [20]), repeat),
+        "topology_s": best_of(lambda: build_topology(gdf), repeat),
+        "folium_full_map_s": best_of(full_map, repeat),
+        "folium_full_map_bytes": len(full_map()),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark each pipeline stage on the real data and on scaled-up synthetic data."
+    )
+    parser.add_argument(
+        "--factors",
+        type=int,
+        nargs="+",
+        default=[1, 10, 100],
+        help="synthetic scale factors; 1 is the real data",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=worker_counts(),
+        help="overlay worker counts for the scaling curve; the first is the reference",
+    )
+    parser.add_argument(
+        "--overlay-factor",
+        type=int,
+        default=10,
+        help="synthetic scale factor the overlay scaling curve is also run on",
+    )
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    gdf = process()
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "geos": shapely.geos_version_string,
+            "timestamp": time.time(),
+        },
+        "description_parsing": bench_description_parsing(args.repeat),
+        "process": bench_process(args.repeat),
+        "sources": bench_sources(args.repeat),
+        "simplification_bytes": bench_simplification(),
+        "topology_bytes": bench_topology(),
+        "serialization": bench_serialization(args.repeat),
+        "lineage": bench_lineage(args.repeat),
+        "precision": bench_precision(args.repeat),
+        "vector_tiles": bench_vector_tiles(args.repeat),
+        "overlay_workers": {
+            "1": bench_overlay_workers(gdf, args.workers, args.repeat),
+            str(args.overlay_factor): bench_overlay_workers(
+                synthetic_boundaries(gdf, args.overlay_factor),
+                args.workers,
+                args.repeat,
+            ),
+        },
+        "scaling": {},
+    }
+
+    for factor in args.factors:
+        dataset = gdf if factor == 1 else synthetic_boundaries(gdf, factor)
+        results["scaling"][str(factor)] = bench_stages(dataset, args.repeat)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
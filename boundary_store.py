@@ -0,0 +1,44 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+class BoundaryStore:
+    # read-only boundaries shared by every session in the process, indexed by (year, ED_DESC);
+    # slices are built once and handed out as-is, so callers must not modify them
+    def __init__(self, gdf):
+        # the geometries are shared by every session and the warm-up thread, so they are
+        # never prepared: GEOS builds a prepared geometry lazily on first use, and one
+        # queried from two threads at once can crash the process
+        self.gdf = gdf.reset_index(drop=True)
+
+        year = pd.Categorical(self.gdf["year"])
+        ed_desc = pd.Categorical(self.gdf["ED_DESC"])
+        self.years = list(year.categories)
+        self.constituencies = list(ed_desc.categories)
+
+        # row positions per key, grouped on the categorical codes
+        positions = pd.Series(np.arange(len(self.gdf)))
+        self._year_rows = positions.groupby(year, observed=True).indices
+        self._constituency_rows = positions.groupby(
+            [year, ed_desc], observed=True
+        ).indices
+
+        self._slices = {}
+        self._lock = threading.Lock()
+
+    def _slice(self, key, rows):
+        with self._lock:
+            if key not in self._slices:
+                if rows is None:
+                    rows = np.array([], dtype=int)
+                self._slices[key] = self.gdf.iloc[rows].reset_index(drop=True)
+            return self._slices[key]
+
+    def year_frame(self, year):
+        return self._slice(year, self._year_rows.get(year))
+
+    def constituency_frame(self, year, constituency):
+        key = (year, constituency)
+        return self._slice(key, self._constituency_rows.get(key))
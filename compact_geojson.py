@@ -0,0 +1,43 @@
+import numpy as np
+import orjson
+import shapely
+
+# 5 decimal places of a degree is about 1.1 m on the ground at Singapore's latitude
+COORDINATE_PRECISION = 5
+
+
+def round_geometries(geometries, precision=COORDINATE_PRECISION):
+    # drop the z values the source files carry and round x/y to `precision` decimals
+    return shapely.transform(
+        shapely.force_2d(np.asarray(geometries)), lambda coords: coords.round(precision)
+    )
+
+
+def to_geojson(gdf, fields, precision=COORDINATE_PRECISION):
+    # compact FeatureCollection text of gdf with only `fields` as properties;
+    # geometries are written by GEOS and properties by orjson, then joined as bytes
+    if gdf.crs is not None and not gdf.crs.equals(4326):
+        gdf = gdf.to_crs(4326)
+
+    geometries = shapely.to_geojson(round_geometries(gdf.geometry.values, precision))
+    columns = [gdf[field].tolist() for field in fields]
+
+    features = b",".join(
+        b'{"type":"Feature","properties":%s,"geometry":%s}'
+        % (orjson.dumps(dict(zip(fields, values))), geometry.encode())
+        for geometry, *values in zip(geometries, *columns)
+    )
+    return b'{"type":"FeatureCollection","features":[%s]}' % features
+
+
+def html_safe(payload):
+    # escape the characters jinja's tojson escapes, so JSON text can sit inside a <script>;
+    # they can only occur inside strings, where the \u escapes mean the same
+    for char, escaped in [
+        (b"<", b"\\u003c"),
+        (b">", b"\\u003e"),
+        (b"&", b"\\u0026"),
+        (b"'", b"\\u0027"),
+    ]:
+        payload = payload.replace(char, escaped)
+    return payload
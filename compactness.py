@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import shapely
+
+from data_processing import boundary_keys, process, read_cache, write_cache
+
+COMPACTNESS_VERSION = 1
+
+# metric column -> display name; all are 1 for a circle and fall towards 0 as shapes sprawl
+METRICS = {
+    "polsby_popper": "Polsby-Popper",
+    "reock": "Reock",
+    "schwartzberg": "Schwartzberg",
+    "convex_hull": "Convex hull ratio",
+}
+
+
+def compute_compactness(gdf):
+    # shape metrics of every constituency in every year, in one pass over the
+    # geometry array in SVY21 (EPSG:3414) so areas and lengths are in metres
+    geometry = np.asarray(gdf.geometry.to_crs(3414).values)
+
+    area = shapely.area(geometry)
+    perimeter = shapely.length(geometry)
+    radius = shapely.minimum_bounding_radius(geometry)
+    hull_area = shapely.area(shapely.convex_hull(geometry))
+
+    return pd.DataFrame(
+        {
+            "year": gdf["year"].to_numpy(),
+            "ED_DESC": gdf["ED_DESC"].to_numpy(),
+            "area_km2": area / 1e6,
+            "perimeter_km": perimeter / 1e3,
+            # area against a circle with the same perimeter
+            "polsby_popper": 4 * np.pi * area / perimeter**2,
+            # area against the smallest circle enclosing the constituency
+            "reock": area / (np.pi * radius**2),
+            # perimeter of a circle with the same area, against the perimeter
+            "schwartzberg": 2 * np.sqrt(np.pi * area) / perimeter,
+            "convex_hull": area / hull_area,
+        }
+    )
+
+
+def process_compactness(gdf=None, use_cache=True):
+    hashes = boundary_keys()
+    hashes["compactness"] = COMPACTNESS_VERSION
+
+    if use_cache:
+        compactness = read_cache("compactness", hashes, geo=False)
+        if compactness is not None:
+            return compactness
+
+    if gdf is None:
+        gdf = process()
+
+    compactness = compute_compactness(gdf)
+    write_cache(compactness, "compactness", hashes)
+
+    return compactness
+
+
+if __name__ == "__main__":
+    process_compactness(use_cache=False)
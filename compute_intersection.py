@@ -1,44 +1,44 @@
-import geopandas as gpd
-from shapely.geometry import shape
+import numpy as np
+import shapely
 from shapely.affinity import scale
 
+from instrumentation import stage
+
 
 def compute_intersect(gdf_all, gdf_single, constituency):
     # get the interesection areas between the two selection years
+    # gdf_all is expected to have a RangeIndex; returned indices are positional
+
+    if len(gdf_single) == 0:
+        return [], [], []
+
+    with stage("compute_intersect", constituency=constituency) as timing:
+        result = intersect(gdf_all, gdf_single, constituency)
+        timing["fragments"] = len(result[1])
+    return result
+
+
+def intersect(gdf_all, gdf_single, constituency):
+    single = gdf_single.geometry.iloc[0]
+    scaled_single = scale(single, xfact=0.31, yfact=0.31, origin="centroid")
+
+    # candidates other than the selected constituency itself
+    other = gdf_all.ED_DESC.to_numpy() != constituency
+
+    # bulk predicate against the spatial index; GEOS prepares the query geometry once
+    scale_intersect_idx = np.sort(
+        gdf_all.sindex.query(scaled_single, predicate="intersects")
+    )
+    scale_intersect_idx = scale_intersect_idx[other[scale_intersect_idx]]
+
+    # frames from BoundaryStore are shared across threads and must not be prepared in
+    # place; the tree query prepares its own copy of the query geometry for this call
+    intersect_idx = np.sort(gdf_all.sindex.query(single, predicate="intersects"))
+    intersect_idx = intersect_idx[other[intersect_idx]]
+
+    intersect_polygon = shapely.intersection(
+        single, gdf_all.geometry.values[intersect_idx]
+    )
+    ed_desc = gdf_all.ED_DESC.to_numpy()[intersect_idx]
 
-    scale_intersect_idx = []
-    for idx, row in gdf_all.iterrows():
-        if gdf_all.iloc[idx].ED_DESC != constituency:
-            scaled_gdf_single = gdf_single.copy()
-            scaled_gdf_single["geometry"] = scaled_gdf_single["geometry"].apply(
-                lambda x: scale(x, xfact=0.31, yfact=0.31, origin="centroid")
-            )
-            if (
-                gdf_all.iloc[idx : idx + 1]
-                .reset_index()
-                .intersects(scaled_gdf_single.reset_index())
-                .bool()
-            ):
-                scale_intersect_idx.append(idx)
-
-    intersect_idx = []
-    for idx, row in gdf_all.iterrows():
-        if gdf_all.iloc[idx].ED_DESC != constituency:
-            if (
-                gdf_all.iloc[idx : idx + 1]
-                .reset_index()
-                .intersects(gdf_single.reset_index())
-                .bool()
-            ):
-                intersect_idx.append(idx)
-
-    intersect_polygon = []
-    ed_desc = []
-
-    for i in intersect_idx:
-        intersect_polygon.append(
-            gdf_single.geometry.intersection(gdf_all.iloc[i].geometry).values[0]
-        )
-        ed_desc.append(gdf_all.iloc[i].ED_DESC)
-
-    return scale_intersect_idx, intersect_polygon, ed_desc
+    return scale_intersect_idx.tolist(), list(intersect_polygon), ed_desc.tolist()
@@ -0,0 +1,250 @@
+import itertools
+import math
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from data_processing import boundary_keys, process, read_cache, write_cache
+from instrumentation import stage
+
+OVERLAY_VERSION = 4
+
+# overlay tasks run across this many workers; 1 computes every pair in the calling thread.
+# threads by default, as the vectorized shapely operations release the GIL; set
+# OVERLAY_EXECUTOR=process where the pandas work around them holds it for too long
+OVERLAY_WORKERS = int(os.environ.get("OVERLAY_WORKERS", os.cpu_count() or 1))
+OVERLAY_EXECUTOR = os.environ.get("OVERLAY_EXECUTOR", "thread")
+
+
+def highest_dimension(geometry):
+    # an intersection mixes polygons with the lines and points where the two boundaries only
+    # touch; each such collection keeps just its highest-dimension parts, so a fragment is
+    # an area wherever it has one, and folium can draw it
+    geometry = np.array(geometry, dtype=object)
+    collections = np.flatnonzero(shapely.get_type_id(geometry) == 7)
+    if len(collections) == 0:
+        return geometry
+
+    parts, index = shapely.get_parts(geometry[collections], return_index=True)
+    parts, part_index = shapely.get_parts(parts, return_index=True)
+    index = index[part_index]
+
+    dimension = shapely.get_dimensions(parts)
+    top = np.zeros(len(collections), dtype=int)
+    np.maximum.at(top, index, dimension)
+    keep = dimension == top[index]
+    parts, index = parts[keep], index[keep]
+
+    for dim, collect in enumerate(
+        [shapely.multipoints, shapely.multilinestrings, shapely.multipolygons]
+    ):
+        selected = top[index] == dim
+        rows, indices = np.unique(index[selected], return_inverse=True)
+        if len(rows):
+            geometry[collections[rows]] = collect(parts[selected], indices=indices)
+    return geometry
+
+
+def compute_pair_overlay(gdf_year, gdf_other):
+    # intersect every constituency of one year with every constituency of another year;
+    # geometry is intersection(year piece, other_year piece) so the rows match what
+    # compute_intersect returns with the year piece as gdf_single
+    gdf_year = gdf_year.reset_index(drop=True)
+    gdf_other = gdf_other.reset_index(drop=True)
+
+    # envelope candidates, then the exact test with the other year's pieces prepared;
+    # they are prepared in place, so callers pass geometries no other thread uses
+    # (compute_pair_overlays hands in its own copies, prepared once per year)
+    other_geometry = np.asarray(gdf_other.geometry.values)
+    shapely.prepare(other_geometry)
+    year_idx, other_idx = gdf_other.sindex.query(gdf_year.geometry)
+    hit = shapely.intersects(
+        other_geometry[other_idx], gdf_year.geometry.values[year_idx]
+    )
+    year_idx, other_idx = year_idx[hit], other_idx[hit]
+
+    order = np.lexsort((other_idx, year_idx))
+    year_idx, other_idx = year_idx[order], other_idx[order]
+
+    year_area = gdf_year.geometry.to_crs(3414).area.to_numpy()
+
+    overlay = gpd.GeoDataFrame(
+        {
+            "year": gdf_year["year"].to_numpy()[year_idx],
+            "ED_DESC": gdf_year["ED_DESC"].to_numpy()[year_idx],
+            "other_year": gdf_other["year"].to_numpy()[other_idx],
+            "other_ED_DESC": gdf_other["ED_DESC"].to_numpy()[other_idx],
+            "geometry": highest_dimension(
+                shapely.intersection(
+                    gdf_year.geometry.values[year_idx],
+                    gdf_other.geometry.values[other_idx],
+                )
+            ),
+        },
+        crs=gdf_year.crs,
+    )
+
+    # fragment areas in square metres (SVY21), and as a share of the year's constituency
+    overlay["area"] = overlay.geometry.to_crs(3414).area
+    overlay["share"] = overlay["area"] / year_area[year_idx]
+
+    # stable sort keeps the compare-year order within each lookup key
+    return overlay.sort_values("ED_DESC", kind="stable").reset_index(drop=True)
+
+
+def spatial_clusters(gdf, n):
+    # row positions of one year's constituencies in up to n groups of neighbours, cut from
+    # their order along a Hilbert curve; all rows of a constituency land in one group, and
+    # each group is in row order, so the groups' overlays sort back into the serial order
+    if n <= 1 or len(gdf) == 0:
+        return [np.arange(len(gdf))]
+
+    names = gdf["ED_DESC"].to_numpy()
+    distance = pd.Series(gdf.geometry.hilbert_distance().to_numpy(), index=names)
+    order = distance.groupby(level=0).min().sort_values(kind="stable").index.to_numpy()
+    return [
+        np.flatnonzero(np.isin(names, group))
+        for group in np.array_split(order, n)
+        if len(group)
+    ]
+
+
+def own_geometries(gdf):
+    # the frame with its own copies of the geometries, sharing nothing prepared
+    geometry = shapely.from_wkb(shapely.to_wkb(gdf.geometry.values))
+    return gdf.set_geometry(gpd.GeoSeries(geometry, index=gdf.index, crs=gdf.crs))
+
+
+def compute_pair_overlays(
+    gdf, pairs, workers=OVERLAY_WORKERS, executor=OVERLAY_EXECUTOR
+):
+    # compute_pair_overlay for each (year, other_year), split into one task per pair and
+    # spatial cluster of the year's constituencies; same rows, in the same order, for any
+    # number of workers
+    years = sorted({year for pair in pairs for year in pair})
+    frames = {
+        year: own_geometries(gdf[gdf["year"] == year].reset_index(drop=True))
+        for year in years
+    }
+    # pairs alone keep most pools busy; clusters only split them when there are too few
+    # pairs for about two tasks per worker, e.g. the pairs of a newly added year
+    split = math.ceil(2 * workers / len(pairs)) if pairs else 1
+    clusters = {year: spatial_clusters(frames[year], split) for year in years}
+
+    tasks = [
+        (year, other_year, rows)
+        for year, other_year in pairs
+        for rows in clusters[year]
+    ]
+    year_frames = [frames[year].iloc[rows] for year, _, rows in tasks]
+    other_years = [other_year for _, other_year, _ in tasks]
+
+    if workers <= 1:
+        results = [
+            compute_pair_overlay(year_frame, frames[other_year])
+            for year_frame, other_year in zip(year_frames, other_years)
+        ]
+    elif executor == "process":
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(
+                pool.map(
+                    compute_pair_overlay,
+                    year_frames,
+                    [frames[other_year] for other_year in other_years],
+                )
+            )
+    else:
+        # GEOS builds parts of a prepared geometry lazily on first use, so one must not be
+        # queried from two threads at once; each thread prepares its own copy of a year
+        local = threading.local()
+
+        def run(year_frame, other_year):
+            copies = local.__dict__.setdefault("frames", {})
+            if other_year not in copies:
+                copies[other_year] = own_geometries(frames[other_year])
+            return compute_pair_overlay(year_frame, copies[other_year])
+
+        with ThreadPoolExecutor(workers) as pool:
+            results = list(pool.map(run, year_frames, other_years))
+
+    overlays = {}
+    for (year, other_year, _), result in zip(tasks, results):
+        overlays.setdefault((year, other_year), []).append(result)
+    return {
+        pair: pd.concat(parts, ignore_index=True)
+        .sort_values("ED_DESC", kind="stable")
+        .reset_index(drop=True)
+        for pair, parts in overlays.items()
+    }
+
+
+def compute_overlay(gdf, workers=OVERLAY_WORKERS, executor=OVERLAY_EXECUTOR):
+    # overlay of all ordered year pairs
+    years = sorted(gdf["year"].unique())
+    overlays = compute_pair_overlays(
+        gdf, list(itertools.product(years, years)), workers, executor
+    )
+    return gpd.GeoDataFrame(
+        pd.concat(overlays.values(), ignore_index=True), crs=gdf.crs
+    )
+
+
+def process_overlay(gdf=None, use_cache=True):
+    # one cache per ordered year pair, keyed on just those two years, so a new year
+    # only computes the pairs it is part of
+    keys = boundary_keys()
+    pairs = list(itertools.product(keys, keys))
+    hashes = {
+        (year, other_year): {
+            "year": keys[year],
+            "other_year": keys[other_year],
+            "overlay": OVERLAY_VERSION,
+        }
+        for year, other_year in pairs
+    }
+
+    overlays = {}
+    if use_cache:
+        for pair in pairs:
+            overlay = read_cache("overlay_{}_{}".format(*pair), hashes[pair])
+            if overlay is not None:
+                overlays[pair] = overlay
+
+    missing = [pair for pair in pairs if pair not in overlays]
+    if missing:
+        if gdf is None:
+            gdf = process()
+        with stage(
+            "compute_overlay",
+            pairs=len(missing),
+            workers=OVERLAY_WORKERS,
+            executor=OVERLAY_EXECUTOR,
+        ) as timing:
+            computed = compute_pair_overlays(gdf, missing)
+            timing["fragments"] = sum(len(overlay) for overlay in computed.values())
+        for pair, overlay in computed.items():
+            write_cache(overlay, "overlay_{}_{}".format(*pair), hashes[pair])
+        overlays.update(computed)
+
+    frames = [overlays[pair] for pair in pairs]
+    overlay = gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), crs=frames[0].crs)
+    return overlay.set_index(["year", "other_year", "ED_DESC"], drop=False)
+
+
+def get_fragments(overlay, year, other_year, constituency):
+    # pieces of the constituency in `year` that belong to other constituencies in `other_year`
+    key = (year, other_year, constituency)
+    if key not in overlay.index:
+        return overlay.iloc[0:0].reset_index(drop=True)
+
+    fragments = overlay.loc[[key]].reset_index(drop=True)
+    return fragments[fragments["other_ED_DESC"] != constituency].reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    process_overlay(use_cache=False)
@@ -1,25 +1,183 @@
+import hashlib
+import os
+
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+RESULTS_FILE = "data/ParliamentaryGeneralElectionResultsbyCandidate.csv"
+ELECTORS_FILE = "data/ParliamentaryGeneralElectionRegisteredElectorsRejectedVotesandSpoiltBallots.csv"
+
+# one Parquet file per election year, rewritten only when that year's source rows change
+INFO_DIR = "data/cache/constituency_info"
+INFO_VERSION = 1
+
+INFO_SCHEMA = pa.schema(
+    [
+        ("year", pa.string()),
+        ("ED_DESC", pa.string()),
+        ("constituency_type", pa.dictionary(pa.int8(), pa.string())),
+        ("pax_number", pa.int8()),
+        ("result", pa.string()),
+        ("registered_electors", pa.int32()),
+        ("rejected_votes", pa.int32()),
+        ("spoilt_ballots", pa.int32()),
+    ]
+)
+
+
+def ed_names(constituency):
+    # same naming as ED_DESC in the boundary files, e.g. "Bishan-Toa Payoh" -> "BISHAN - TOA PAYOH"
+    return constituency.str.upper().str.replace("-", " - ")
+
+
+def constituency_info(results, electors):
+    # one row per constituency per year: type, team size, a readable result string and the
+    # electors / rejected / spoilt counts
+    results = results.copy()
+
+    # candidate names are separated by "|"; use it to count number of candidates
+    results["pax_number"] = results["candidates"].str.count(r"\|") + 1
+
+    # "na" in vote_percentage because walkover; walkover will be assumed as 100% votes
+    percentage = results["vote_percentage"].replace("na", "1").astype(float)
+    vote_count = results["vote_count"].replace("na", "Win by Walkover")
+
+    # e.g. "WP: 58593 (43.9%)"
+    results["result"] = (
+        results["party"]
+        + ": "
+        + vote_count
+        + " ("
+        # %-formatting rounds the exact binary value like round(x, 1); Series.round does not
+        + np.char.mod("%.1f", 100 * percentage.to_numpy())
+        + "%)"
+    )
+
+    info = (
+        results.groupby(["year", "constituency"], sort=False)
+        .agg(
+            constituency_type=("constituency_type", "first"),
+            pax_number=("pax_number", "max"),
+            result=("result", "; ".join),
+        )
+        .reset_index()
+    )
+
+    electors = electors.rename(
+        columns={
+            "no_of_registered_electors": "registered_electors",
+            "no_of_rejected_votes": "rejected_votes",
+            "no_of_spoilt_ballot_papers": "spoilt_ballots",
+        }
+    )
+    for column in ["registered_electors", "rejected_votes", "spoilt_ballots"]:
+        electors[column] = pd.to_numeric(electors[column], errors="coerce")
+
+    info = info.merge(electors, how="left", on=["year", "constituency"])
+
+    info = info.sort_values(["year", "constituency"])
+    info["ED_DESC"] = ed_names(info.pop("constituency"))
+    # pre-1988 constituencies have no GRC/SMC type
+    info["constituency_type"] = info["constituency_type"].replace("na", None)
+
+    return pa.Table.from_pandas(info, schema=INFO_SCHEMA, preserve_index=False)
+
+
+def rows_hash(*frames):
+    h = hashlib.sha256(str(INFO_VERSION).encode())
+    for frame in frames:
+        h.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def info_path(year):
+    return os.path.join(INFO_DIR, "{}.parquet".format(year))
+
+
+def stored_hash(path):
+    if not os.path.exists(path):
+        return None
+    metadata = pq.read_schema(path).metadata or {}
+    return metadata.get(b"source_hash", b"").decode()
+
+
+def sources_hash():
+    h = hashlib.sha256(str(INFO_VERSION).encode())
+    for path in [RESULTS_FILE, ELECTORS_FILE]:
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def process_constituency_info():
+    # refresh the per-year Parquet files from the two CSVs; returns the years that were rebuilt.
+    # a hash of both whole files is checked first so the common no-change case is cheap
+    manifest_path = os.path.join(INFO_DIR, "sources.sha256")
+    source_hash = sources_hash()
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            if f.read() == source_hash:
+                return []
+
+    results = pd.read_csv(RESULTS_FILE, dtype=str)
+    electors = pd.read_csv(ELECTORS_FILE, dtype=str)
+
+    os.makedirs(INFO_DIR, exist_ok=True)
+    years = sorted(set(results["year"]) | set(electors["year"]))
+    rebuilt = []
+
+    for year in years:
+        year_results = results[results["year"] == year]
+        year_electors = electors[electors["year"] == year]
+        year_hash = rows_hash(year_results, year_electors)
+
+        path = info_path(year)
+        if stored_hash(path) == year_hash:
+            continue
+
+        table = constituency_info(year_results, year_electors)
+        table = table.replace_schema_metadata({"source_hash": year_hash})
+        pq.write_table(table, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        rebuilt.append(year)
+
+    # years that disappeared from the sources
+    for name in os.listdir(INFO_DIR):
+        if name.endswith(".parquet") and name[: -len(".parquet")] not in years:
+            os.remove(os.path.join(INFO_DIR, name))
 
-raw_df = pd.read_csv("data/ParliamentaryGeneralElectionResultsbyCandidate.csv")
+    with open(manifest_path + ".tmp", "w") as f:
+        f.write(source_hash)
+    os.replace(manifest_path + ".tmp", manifest_path)
 
-# keep only year 2006 onwards
-df = raw_df[raw_df['year'] >= 2006].copy()
+    return rebuilt
 
-# candidate names are separated by "|"; use it to count number of candidates
-df['pax_number'] = df['candidates'].apply(lambda x: len(x.split('|')))
 
-# "na" in vote_percentage becauase walkover; walkover will be assumed as 100% votes
-df['vote_percentage'] = df['vote_percentage'].replace("na","1").astype(float)
-df['vote_count'] = df['vote_count'].replace("na","Win by Walkover")
+def info_hash(year):
+    # hash of the source rows the year's file was built from; None for a year with no results
+    return stored_hash(info_path(year))
 
-df_constituency = df[['year','constituency','constituency_type','pax_number','party','vote_count','vote_percentage']].copy()
 
-# create result column to aggregate contested parties, votes and vote percentages
-df_constituency['result'] = df.apply(lambda x: x['party'] + ": " + x['vote_count'] + " (" + str(round(100*x['vote_percentage'],1)) + "%)", axis=1)
+def load_constituency_info(years=None):
+    # the given years (default all) as one typed DataFrame, refreshing any stale year first
+    process_constituency_info()
+    if years is None:
+        years = sorted(
+            name[: -len(".parquet")]
+            for name in os.listdir(INFO_DIR)
+            if name.endswith(".parquet")
+        )
+    tables = [
+        pq.read_table(info_path(year), schema=INFO_SCHEMA)
+        for year in years
+        if os.path.exists(info_path(year))
+    ]
+    return pa.concat_tables(tables or [INFO_SCHEMA.empty_table()]).to_pandas(
+        types_mapper={pa.int32(): pd.Int32Dtype()}.get
+    )
 
-final_df = df_constituency.groupby(['year', 'constituency','constituency_type','pax_number'])['result'].agg('; '.join).reset_index()
-final_df = final_df.sort_values(['year','constituency'])
-final_df['constituency'] = final_df['constituency'].str.upper().str.replace("-", " - ")
-final_df = final_df.rename({'constituency': 'ED_DESC'}, axis=1)
 
-final_df.to_csv("data/constituency_info_2006to2020.csv", index=False)
\ No newline at end of file
+if __name__ == "__main__":
+    print("rebuilt years: {}".format(", ".join(process_constituency_info()) or "none"))
@@ -1,7 +1,39 @@
+import functools
+import hashlib
+import html
+import json
+import os
+import re
+
 import geopandas as gpd
 import pandas as pd
+import pyarrow.parquet as pq
+import pyproj
 from bs4 import BeautifulSoup
 
+from instrumentation import stage
+from constituency_processing import (
+  info_hash,
+  load_constituency_info,
+  process_constituency_info,
+)
+from kml_reader import read_kml
+from precision import normalize_geometries
+
+# on-disk caches of the merged GeoDataFrame and everything derived from it; each is
+# rebuilt only when one of its inputs changes
+CACHE_DIR = "data/cache"
+CACHE_VERSION = 6
+
+DATA_DIR = "data"
+
+# boundary file names per source format, one file per election year; both formats give
+# the same boundaries, the KML files parse faster
+BOUNDARY_FILE_PATTERNS = {
+  "geojson": r"ElectoralBoundary{year}GEOJSON\.geojson",
+  "kml": r"ElectoralBoundary{year}KML\.kml",
+}
+
 # function to extract electoral name from description column in raw data
 def ed_desc(x):
     # Parse the HTML using BeautifulSoup
@@ -10,39 +42,205 @@ def ed_desc(x):
     # Find the <td> element that follows the <th> element with text 'ED_DESC'
     return soup.find('th', string='ED_DESC').find_next_sibling('td').text.strip()
 
-def process():
-  # Load GeoJSON data
-  # exclude 2020 first as it has different column structure
-  year = ["2006", "2011", "2015"]
+# batch version of ed_desc; one regex pass over the whole description column
+# returns every <th>/<td> attribute (ED_CODE, ED_DESC, INC_CRC, FMEL_UPD_D) as a column
+def description_attributes(descriptions):
+  values = pd.Series(descriptions.to_numpy(), dtype=object)
+  pairs = values.str.extractall(r"<th>(?P<key>[^<]+)</th>\s*<td>(?P<value>[^<]*)</td>")
+
+  attrs = pairs.droplevel("match").pivot(columns="key", values="value")
+  # unescape entities the same way BeautifulSoup's .text does, then strip the padding
+  attrs = attrs.reindex(range(len(values))).apply(
+    lambda col: col.map(html.unescape, na_action="ignore").str.strip()
+  )
+
+  attrs.index = descriptions.index
+  attrs.columns.name = None
+  return attrs
+
+def file_hash(path):
+  h = hashlib.sha256()
+  with open(path, "rb") as f:
+    for chunk in iter(lambda: f.read(1 << 20), b""):
+      h.update(chunk)
+  return h.hexdigest()
+
+def source_hashes(paths):
+  # content hashes of the inputs, plus the cache format so a change in build logic also invalidates
+  hashes = {path: file_hash(path) for path in paths}
+  hashes["version"] = CACHE_VERSION
+  return hashes
+
+def cache_path(name, ext):
+  return os.path.join(CACHE_DIR, "{}.{}".format(name, ext))
+
+def cache_is_fresh(name, ext, hashes):
+  # true if the cached artifact was built from exactly these inputs
+  manifest_path = cache_path(name, "manifest.json")
+
+  if not (os.path.exists(manifest_path) and os.path.exists(cache_path(name, ext))):
+    return False
+
+  with open(manifest_path) as f:
+    return json.load(f) == hashes
+
+def write_manifest(name, hashes):
+  # written last and atomically, so a concurrent reader never sees a half-written cache
+  manifest_path = cache_path(name, "manifest.json")
+  with open(manifest_path + ".tmp", "w") as f:
+    json.dump(hashes, f, indent=2)
+  os.replace(manifest_path + ".tmp", manifest_path)
+
+def read_cache(name, hashes, geo=True):
+  # return the cached (Geo)DataFrame if it is fresh, else None
+  if not cache_is_fresh(name, "parquet", hashes):
+    return None
+
+  if geo:
+    return read_geoparquet(cache_path(name, "parquet"))
+  return pd.read_parquet(cache_path(name, "parquet"), memory_map=True)
+
+@functools.lru_cache(maxsize=None)
+def parse_crs(crs_json):
+  return pyproj.CRS.from_json(crs_json)
 
-  for idx, y in enumerate(year):
-      if idx == 0:
-          raw_gdf = gpd.read_file("data/ElectoralBoundary{}GEOJSON.geojson".format(str(y))).to_crs(4326)
-          raw_gdf['year'] = y
-      else:
-          temp_gdf = gpd.read_file("data/ElectoralBoundary{}GEOJSON.geojson".format(str(y))).to_crs(4326)
-          temp_gdf['year'] = y
-          raw_gdf = pd.concat([raw_gdf, temp_gdf], axis=0)
+def read_geoparquet(path):
+  # gpd.read_parquet, but with the CRS parsed once per process rather than once per file;
+  # building a CRS from its PROJJSON takes longer than reading a small cache
+  table = pq.read_table(path, memory_map=True)
+  geo = json.loads(table.schema.metadata[b"geo"])
+  column = geo["primary_column"]
+  crs = geo["columns"][column].get("crs")
 
-  raw_gdf['ED_DESC'] = raw_gdf['Description'].apply(ed_desc)
+  df = table.to_pandas()
+  df[column] = gpd.GeoSeries.from_wkb(
+    df[column], crs=parse_crs(json.dumps(crs)) if crs else None
+  )
+  return gpd.GeoDataFrame(df, geometry=column)
 
-  gdf = raw_gdf[['year', 'ED_DESC','geometry']].copy()
+def write_cache(gdf, name, hashes):
+  os.makedirs(CACHE_DIR, exist_ok=True)
+  parquet_path = cache_path(name, "parquet")
 
-  # process 2020 data
-  raw_gdf_2020 = gpd.read_file("data/ElectoralBoundary{}GEOJSON.geojson".format(str(2020))).to_crs(4326)
-  raw_gdf_2020['year'] = "2020"
+  gdf.to_parquet(parquet_path + ".tmp", index=False)
+  os.replace(parquet_path + ".tmp", parquet_path)
+  write_manifest(name, hashes)
 
-  gdf_2020 = raw_gdf_2020[['year','ED_DESC','geometry']].copy()
+def read_json_cache(name, hashes):
+  if not cache_is_fresh(name, "json", hashes):
+    return None
 
-  # combine to get overall data
-  gdf = pd.concat([gdf, gdf_2020], axis=0)
+  with open(cache_path(name, "json")) as f:
+    return json.load(f)
 
+def write_json_cache(obj, name, hashes):
+  os.makedirs(CACHE_DIR, exist_ok=True)
+  json_path = cache_path(name, "json")
+
+  with open(json_path + ".tmp", "w") as f:
+    json.dump(obj, f, separators=(",", ":"))
+  os.replace(json_path + ".tmp", json_path)
+  write_manifest(name, hashes)
+
+def discover_years(source="geojson"):
+  # {year: path} of every boundary file of the format in data/; a new election year
+  # only needs its file dropped in with the same naming
+  pattern = re.compile(BOUNDARY_FILE_PATTERNS[source].format(year=r"(\d{4})"))
+  years = {}
+  for name in os.listdir(DATA_DIR):
+    match = pattern.fullmatch(name)
+    if match:
+      years[match.group(1)] = os.path.join(DATA_DIR, name)
+  return dict(sorted(years.items()))
+
+def read_boundary_file(path, source="geojson"):
+  # ED_DESC, ED_CODE and geometry (EPSG:4326) of one year, whatever that year's schema
+  if source == "kml":
+    gdf = read_kml(path)
+  else:
+    gdf = gpd.read_file(path).to_crs(4326)
+    # older files only carry the attributes inside the HTML Description
+    if "ED_DESC" not in gdf.columns:
+      gdf = gdf.join(description_attributes(gdf['Description']))
+
+  gdf = gdf[['ED_DESC', 'ED_CODE', 'geometry']].copy()
   gdf['ED_DESC'] = gdf['ED_DESC'].str.replace(" - ", "-").str.replace("-", " - ")
+  return gdf
+
+def read_boundaries(source="geojson"):
+  # every year's boundaries without constituency info
+  frames = []
+  for y, path in discover_years(source).items():
+    gdf_year = read_boundary_file(path, source)
+    gdf_year.insert(0, 'year', y)
+    frames.append(gdf_year)
+
+  return pd.concat(frames, axis=0, ignore_index=True)
+
+def build_year(year, path, source="geojson"):
+  with stage("read_boundaries", year=year, source=source) as timing:
+    gdf = read_boundary_file(path, source)
+    timing["rows"] = len(gdf)
+  gdf.insert(0, 'year', year)
+
+  # snapped to a fixed grid, without redundant vertices and with invalid rings repaired
+  gdf = gdf.set_geometry(normalize_geometries(gdf.geometry))
+
+  # load constituency data; such as GRC/SMC, voting results, electors
+  constituency_df = load_constituency_info([year])
+
+  return gdf.merge(constituency_df, how='left', on=['year','ED_DESC'])
+
+def build(source="geojson"):
+  # all years from the source files, bypassing the cache
+  return pd.concat(
+    [build_year(y, path, source) for y, path in discover_years(source).items()],
+    axis=0,
+    ignore_index=True,
+  )
+
+def year_hashes(year, path):
+  # inputs of one year's boundaries: its boundary file and its rows in the election CSVs
+  hashes = source_hashes([path])
+  hashes["constituency_info"] = info_hash(year)
+  return hashes
+
+def boundary_keys(source="geojson"):
+  # {year: key} where the key changes whenever that year's inputs change; derived caches
+  # keyed on the years they use are reused as long as those years' keys are unchanged
+  process_constituency_info()
+  return {
+    y: hashlib.sha256(json.dumps(year_hashes(y, path), sort_keys=True).encode()).hexdigest()
+    for y, path in discover_years(source).items()
+  }
+
+def process_year(year, path, source="geojson", use_cache=True):
+  name = "boundaries_{}_{}".format(source, year)
+  hashes = year_hashes(year, path)
+
+  if use_cache:
+    gdf = read_cache(name, hashes)
+    if gdf is not None:
+      return gdf
+
+  gdf = build_year(year, path, source)
+  write_cache(gdf, name, hashes)
 
-  # load constituency data; such as GRC/SMC, voting results
-  constituency_df = pd.read_csv("data/constituency_info_2006to2020.csv")
-  constituency_df['year'] = constituency_df['year'].astype(str)
+  return gdf
 
-  gdf = gdf.merge(constituency_df, how='left', on=['year','ED_DESC'])
+def process(use_cache=True, source="geojson"):
+  # source is "geojson" or "kml"; each year is cached on its own, so adding a year
+  # builds only that year
+  with stage("process", source=source) as timing:
+    process_constituency_info()
+    frames = [
+      process_year(y, path, source, use_cache)
+      for y, path in discover_years(source).items()
+    ]
+    gdf = pd.concat(frames, axis=0, ignore_index=True)
+    timing["rows"] = len(gdf)
+  return gdf
 
-  return gdf
\ No newline at end of file
+if __name__ == "__main__":
+  # build step: refresh the on-disk cache ahead of serving the app
+  process(use_cache=False)
@@ -0,0 +1,95 @@
+import contextlib
+import cProfile
+import json
+import logging
+import os
+import resource
+import threading
+import time
+
+# stage timings and counters as one JSON object per line; set STAGE_LOG to a file path,
+# or "-" for stderr, to write them out; they are always kept for the current run
+logger = logging.getLogger("stages")
+logger.propagate = False
+
+if os.environ.get("STAGE_LOG"):
+    handler = (
+        logging.StreamHandler()
+        if os.environ["STAGE_LOG"] == "-"
+        else logging.FileHandler(os.environ["STAGE_LOG"])
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+PROFILE_DIR = "profiles"
+
+# records of the run in progress; each Streamlit session reruns the script in its own thread
+local = threading.local()
+
+
+def rss_bytes(pid="self"):
+    # current resident set size of this or another process; /proc on Linux, else this
+    # process's peak so far
+    try:
+        with open("/proc/{}/statm".format(pid)) as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def start_run(**fields):
+    # begin collecting records for one script run
+    local.run = {"id": "{:x}".format(time.time_ns()), **fields}
+    local.records = []
+
+
+def run_records():
+    return list(getattr(local, "records", []))
+
+
+def record(name, **fields):
+    # one log line for a stage or counter, tagged with the current run
+    entry = {"stage": name, "time": time.time(), **fields}
+    if getattr(local, "run", None):
+        entry["run"] = local.run["id"]
+        local.records.append(entry)
+    logger.info(json.dumps(entry, default=str))
+    return entry
+
+
+@contextlib.contextmanager
+def stage(name, **fields):
+    # wall time and RSS change of the enclosed block; fields set on the yielded dict
+    # inside the block (e.g. payload sizes) are logged with it
+    extra = dict(fields)
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    try:
+        yield extra
+    finally:
+        rss_after = rss_bytes()
+        record(
+            name,
+            s=time.perf_counter() - start,
+            rss_bytes=rss_after,
+            rss_delta_bytes=rss_after - rss_before,
+            **extra,
+        )
+
+
+def start_profile():
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profile(profiler, name="run"):
+    # dump the capture for snakeviz / pstats; returns the file path
+    profiler.disable()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(
+        PROFILE_DIR, "{}-{}.prof".format(name, time.strftime("%Y%m%d-%H%M%S"))
+    )
+    profiler.dump_stats(path)
+    return path
@@ -0,0 +1,95 @@
+import re
+import zipfile
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from lxml import etree
+
+# fallback for KML without ExtendedData (the KMZ), whose attributes only sit in an HTML table
+DESCRIPTION_FIELD = r"<td>{}</td>\s*<td>(.*?)</td>"
+
+
+def open_kml(path):
+    # file object for the KML text; a KMZ is a zip holding doc.kml, read without extracting
+    if path.endswith(".kmz"):
+        archive = zipfile.ZipFile(path)
+        name = next(n for n in archive.namelist() if n.endswith(".kml"))
+        return archive.open(name)
+    return open(path, "rb")
+
+
+def parse_coordinates(text):
+    # "x,y[,z] x,y[,z] ..." -> (n, 2 or 3) array
+    tuples = text.split()
+    dims = tuples[0].count(",") + 1
+    return np.array(",".join(tuples).split(","), dtype=float).reshape(-1, dims)
+
+
+def placemark_field(placemark, name):
+    value = placemark.findtext(".//{{*}}SimpleData[@name='{}']".format(name))
+    if value is None:
+        match = re.search(
+            DESCRIPTION_FIELD.format(name), placemark.findtext("{*}description") or ""
+        )
+        value = match.group(1) if match else None
+    return value.strip() if value is not None else None
+
+
+def read_kml(path, fields=("ED_DESC", "ED_CODE")):
+    # stream Placemarks one at a time, keeping only their attributes and coordinate arrays;
+    # geometries are assembled at the end with one shapely call per level
+    records = {field: [] for field in fields}
+    coords = []
+    ring_polygon = []
+    polygon_feature = []
+    polygon_count = []
+
+    with open_kml(path) as f:
+        for _, placemark in etree.iterparse(f, events=("end",), tag="{*}Placemark"):
+            for field in fields:
+                records[field].append(placemark_field(placemark, field))
+
+            feature = len(polygon_count)
+            count = 0
+            for polygon in placemark.iter("{*}Polygon"):
+                rings = polygon.findall(
+                    "{*}outerBoundaryIs/{*}LinearRing/{*}coordinates"
+                ) + polygon.findall("{*}innerBoundaryIs/{*}LinearRing/{*}coordinates")
+                for ring in rings:
+                    coords.append(parse_coordinates(ring.text))
+                    ring_polygon.append(len(polygon_feature))
+                polygon_feature.append(feature)
+                count += 1
+            polygon_count.append(count)
+
+            # drop the parsed Placemark and everything before it so the tree never grows
+            placemark.clear()
+            while placemark.getprevious() is not None:
+                del placemark.getparent()[0]
+
+    # pad 2D rings so every ring has the same width as the widest one
+    dims = max(ring.shape[1] for ring in coords)
+    coords = [
+        (
+            np.pad(ring, ((0, 0), (0, dims - ring.shape[1])))
+            if ring.shape[1] < dims
+            else ring
+        )
+        for ring in coords
+    ]
+
+    ring_index = np.repeat(np.arange(len(coords)), [len(ring) for ring in coords])
+    rings = shapely.linearrings(np.concatenate(coords), indices=ring_index)
+
+    # the first ring of each polygon is its shell, the rest are holes
+    polygons = shapely.polygons(rings, indices=ring_polygon)
+
+    # a Placemark with one polygon is a Polygon, as in the GeoJSON files; more make a MultiPolygon
+    polygon_feature = np.asarray(polygon_feature)
+    polygon_count = np.asarray(polygon_count)
+    geometry = shapely.multipolygons(polygons, indices=polygon_feature)
+    single = polygon_count == 1
+    geometry[single] = polygons[np.flatnonzero(single[polygon_feature])]
+
+    return gpd.GeoDataFrame(records, geometry=geometry, crs=4326)
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+
+class Lineage:
+    # constituency lineage across years as a CSR adjacency list: nodes are (year, ED_DESC),
+    # an edge (year, a) -> (other_year, b) carries the share of a's area that lies in b.
+    # each node's edges are grouped by other_year and sorted by share, largest first
+    def __init__(self, transfers):
+        edges = transfers[transfers["year"] != transfers["other_year"]]
+
+        nodes = pd.concat(
+            [
+                edges[["year", "ED_DESC"]],
+                edges[["other_year", "other_ED_DESC"]].set_axis(
+                    ["year", "ED_DESC"], axis=1
+                ),
+            ]
+        ).drop_duplicates()
+        nodes = nodes.sort_values(["year", "ED_DESC"]).reset_index(drop=True)
+
+        self.years = nodes["year"].to_numpy()
+        self.names = nodes["ED_DESC"].to_numpy()
+        self.node_ids = {node: i for i, node in enumerate(zip(self.years, self.names))}
+
+        source = np.array(
+            [self.node_ids[node] for node in zip(edges["year"], edges["ED_DESC"])],
+            dtype=np.int32,
+        )
+        target = np.array(
+            [
+                self.node_ids[node]
+                for node in zip(edges["other_year"], edges["other_ED_DESC"])
+            ],
+            dtype=np.int32,
+        )
+        share = edges["share"].to_numpy(dtype=np.float32)
+
+        order = np.lexsort((-share, self.years[target], source))
+
+        self.indices = target[order]
+        self.weights = share[order]
+        self.indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(source, minlength=len(nodes)), out=self.indptr[1:])
+
+    def edges(self, year, constituency):
+        # (other_year, ED_DESC, share) of every edge out of one node; O(degree)
+        i = self.node_ids.get((year, constituency))
+        if i is None:
+            return []
+
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return [
+            (self.years[j], self.names[j], float(w))
+            for j, w in zip(self.indices[start:end], self.weights[start:end])
+        ]
+
+    def related(self, year, constituency, other_year, min_share=0.0):
+        # `other_year` constituencies holding at least min_share of the constituency's area
+        return [
+            name
+            for edge_year, name, share in self.edges(year, constituency)
+            if edge_year == other_year and share >= min_share
+        ]
+
+    def predecessors(self, year, constituency, min_share=0.0):
+        return [
+            edge
+            for edge in self.edges(year, constituency)
+            if edge[0] < year and edge[2] >= min_share
+        ]
+
+    def successors(self, year, constituency, min_share=0.0):
+        return [
+            edge
+            for edge in self.edges(year, constituency)
+            if edge[0] > year and edge[2] >= min_share
+        ]
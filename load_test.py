@@ -0,0 +1,316 @@
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+import urllib.request
+
+import numpy as np
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from tornado.websocket import websocket_connect
+
+from instrumentation import rss_bytes
+
+SCRIPT = "main.py"
+
+# widget labels in main.py, by the action that changes them
+LABELS = {
+    "baseline": "Select the year as baseline",
+    "compare": "Select the year for comparison",
+    "compare_type": "Select type of comparison",
+    "constituency": "Select the desired constituency",
+    "map": "Select type of map",
+    "metric": "Colour constituencies by",
+}
+
+# how often a visitor changes each control once both years are picked; only the
+# controls on the page at the time are candidates
+WEIGHTS = {
+    "constituency": 8,
+    "compare_type": 3,
+    "baseline": 2,
+    "compare": 2,
+    "metric": 2,
+    "map": 1,
+}
+
+
+def start_server(port):
+    # the app under a headless Streamlit server, as deployed; returns once it answers
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "streamlit",
+            "run",
+            SCRIPT,
+            "--server.headless",
+            "true",
+            "--server.port",
+            str(port),
+            "--browser.gatherUsageStats",
+            "false",
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(
+                "http://localhost:{}/_stcore/health".format(port)
+            ) as response:
+                if response.read() == b"ok":
+                    return server
+        except OSError:
+            time.sleep(0.2)
+
+    server.kill()
+    raise RuntimeError("streamlit server did not start on port {}".format(port))
+
+
+class Session:
+    # one browser tab: a websocket to the server speaking Streamlit's protobuf protocol,
+    # the widgets drawn by the last run and the values this visitor has picked.
+    # AppTest cannot stand in for this: each AppTest run installs and then clears a
+    # process-wide Runtime, so concurrent AppTests break each other's runs
+    def __init__(self, url):
+        self.url = url
+        self.widgets = {}
+        self.values = {}
+
+    async def connect(self):
+        self.ws = await websocket_connect(self.url, subprotocols=["streamlit"])
+
+    def close(self):
+        self.ws.close()
+
+    async def rerun(self, timeout):
+        # send the widget values as the browser would, and wait for the run to finish;
+        # false if the script raised or did not finish
+        message = BackMsg()
+        message.rerun_script.query_string = ""
+        message.rerun_script.page_script_hash = ""
+        shown = {widget.id for widget in self.widgets.values()}
+        for widget_id, index in self.values.items():
+            if widget_id in shown:
+                state = message.rerun_script.widget_states.widgets.add()
+                state.id = widget_id
+                state.int_value = index
+        await self.ws.write_message(message.SerializeToString(), binary=True)
+
+        self.widgets = {}
+        ok = True
+        while True:
+            raw = await asyncio.wait_for(self.ws.read_message(), timeout)
+            if raw is None:
+                raise ConnectionError("server closed the session")
+
+            forward = ForwardMsg.FromString(raw)
+            kind = forward.WhichOneof("type")
+            if kind == "delta" and forward.delta.WhichOneof("type") == "new_element":
+                element = forward.delta.new_element
+                name = element.WhichOneof("type")
+                if name in ("selectbox", "radio"):
+                    widget = getattr(element, name)
+                    self.widgets[widget.label] = widget
+                elif name == "exception":
+                    ok = False
+            elif kind == "script_finished":
+                return (
+                    ok and forward.script_finished == ForwardMsg.FINISHED_SUCCESSFULLY
+                )
+
+    def widget(self, action):
+        return self.widgets.get(LABELS[action])
+
+    def value(self, action):
+        widget = self.widget(action)
+        index = self.values.get(widget.id)
+        if index is None and widget.HasField("default"):
+            index = widget.default
+        return widget.options[index] if index is not None else None
+
+    def set(self, action, option):
+        widget = self.widget(action)
+        self.values[widget.id] = list(widget.options).index(option)
+
+
+def next_action(session, rng):
+    # a constituency view shows nothing until a constituency is picked, so that comes first
+    if (
+        session.widget("constituency") is not None
+        and session.value("constituency") is None
+    ):
+        action = "constituency"
+    else:
+        actions = [a for a in WEIGHTS if session.widget(a) is not None]
+        action = rng.choices(actions, [WEIGHTS[a] for a in actions])[0]
+
+    current = session.value(action)
+    choices = [o for o in session.widget(action).options if o != current]
+    return action, rng.choice(choices)
+
+
+async def run_session(url, session_id, steps, seed, timeout, start):
+    # one simulated visitor: open the page, pick both years, then `steps` more clicks;
+    # returns (action, seconds, ok) for every rerun, stopping at the first failure
+    rng = random.Random("{}-{}".format(seed, session_id))
+    session = Session(url)
+    await session.connect()
+    await start.wait()
+
+    timings = []
+    actions = ["open", "baseline", "compare"] + [None] * steps
+    try:
+        for action in actions:
+            if action in ("baseline", "compare"):
+                session.set(action, rng.choice(session.widget(action).options))
+            elif action is None:
+                action, option = next_action(session, rng)
+                session.set(action, option)
+
+            begin = time.perf_counter()
+            try:
+                ok = await session.rerun(timeout)
+            except (asyncio.TimeoutError, ConnectionError):
+                ok = False
+            timings.append((action, time.perf_counter() - begin, ok))
+            if not ok:
+                break
+    finally:
+        session.close()
+
+    return timings
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "n": len(values),
+        "mean": float(np.mean(values)),
+        "p50": float(p50),
+        "p95": float(p95),
+        "p99": float(p99),
+        "max": float(np.max(values)),
+    }
+
+
+async def run_level(url, pid, sessions, steps, seed, timeout):
+    # `sessions` visitors clicking at once against the one server process; RSS is the
+    # server's, sampled every 50 ms
+    start = asyncio.Event()
+    peak = [rss_bytes(pid)]
+
+    async def sample_rss():
+        while True:
+            peak[0] = max(peak[0], rss_bytes(pid))
+            await asyncio.sleep(0.05)
+
+    sampler = asyncio.ensure_future(sample_rss())
+    runs = [
+        asyncio.ensure_future(
+            run_session(url, "{}-{}".format(sessions, i), steps, seed, timeout, start)
+        )
+        for i in range(sessions)
+    ]
+
+    # connect every session first so they all start clicking together
+    await asyncio.sleep(0.5)
+    rss_start = rss_bytes(pid)
+    begin = time.perf_counter()
+    start.set()
+    results = await asyncio.gather(*runs)
+    wall = time.perf_counter() - begin
+    rss_end = rss_bytes(pid)
+    sampler.cancel()
+
+    timings = [t for session in results for t in session]
+    latencies = [seconds for _, seconds, ok in timings if ok]
+    actions = sorted({action for action, _, _ in timings})
+
+    return {
+        "sessions": sessions,
+        "reruns": len(timings),
+        "errors": sum(1 for _, _, ok in timings if not ok),
+        "wall_s": wall,
+        "throughput_reruns_per_s": len(latencies) / wall,
+        "latency_s": percentiles(latencies),
+        "by_action": {
+            action: percentiles(
+                [seconds for a, seconds, ok in timings if a == action and ok]
+            )
+            for action in actions
+        },
+        "rss_start_bytes": rss_start,
+        "rss_end_bytes": rss_end,
+        "rss_peak_bytes": max(peak[0], rss_end),
+        "rss_growth_per_session_bytes": (rss_end - rss_start) / sessions,
+    }
+
+
+async def run(args, url, pid):
+    # the first run loads the shared data; timed on its own so the levels see a warm server
+    rss_before = rss_bytes(pid)
+    start = asyncio.Event()
+    start.set()
+    cold = await run_session(url, "cold", 0, args.seed, args.timeout, start)
+    results = {
+        "cold_start_s": cold[0][1],
+        "cold_start_rss_bytes": rss_bytes(pid) - rss_before,
+        "levels": [],
+    }
+    for sessions in args.sessions:
+        results["levels"].append(
+            await run_level(url, pid, sessions, args.steps, args.seed, args.timeout)
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Drive the dashboard with concurrent simulated sessions and report rerun latency, throughput and server memory."
+    )
+    parser.add_argument(
+        "--sessions",
+        type=int,
+        nargs="+",
+        default=[1, 4, 16],
+        help="concurrent session counts, run one after another",
+    )
+    parser.add_argument(
+        "--steps", type=int, default=10, help="clicks per session after both years"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--timeout", type=float, default=300, help="seconds before a rerun fails"
+    )
+    parser.add_argument("--port", type=int, default=8599)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    server = start_server(args.port)
+    try:
+        results = asyncio.run(
+            run(args, "ws://localhost:{}/_stcore/stream".format(args.port), server.pid)
+        )
+    finally:
+        server.terminate()
+        server.wait()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
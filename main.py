@@ -1,16 +1,167 @@
+import functools
+import itertools
+import os
+
+import pandas as pd
 import streamlit as st
-import folium
 from streamlit_folium import st_folium
-from folium.features import GeoJsonPopup, GeoJsonTooltip
-import geopandas as gpd
 
 from data_processing import process
-from compute_intersection import compute_intersect
+from compute_overlay import process_overlay
+from area_transfer import process_transfers, transfer_matrix
+from boundary_store import BoundaryStore
+from compactness import METRICS, process_compactness
+from instrumentation import (
+    record,
+    run_records,
+    stage,
+    start_profile,
+    start_run,
+    stop_profile,
+)
+from simplify_boundaries import process_simplified, simplified_frame, tolerance_for_zoom
+from lineage import Lineage
+from map_cache import MapCache
+from notional import compute_notional, notional_table
+from topology import process_topology
+from vector_tiles import process_tiles, start_tile_server
+from views import (
+    COMPARE_TYPES,
+    assemble_panels,
+    build_view,
+    layer_payloads,
+    prepare_panels,
+    retained_size,
+)
+from warmup import CHANGES, FULL_MAP, Warmup
+
+
+# loaded once per server process and shared read-only by every session
+@st.cache_resource(show_spinner=False)
+def load_data():
+    gdf = process()
+    overlay = process_overlay(gdf)
+    lod = process_simplified(gdf)
+    transfers = process_transfers(overlay)
+
+    # full map opens at zoom 11, constituency views at zoom 12
+    return {
+        "store": BoundaryStore(gdf),
+        "overlay": overlay,
+        "transfers": transfers,
+        "lineage": Lineage(transfers),
+        # cheap enough to recompute for every year pair on each start, so it is not cached on disk
+        "notional": compute_notional(transfers),
+        "compactness": process_compactness(gdf),
+        "display": {
+            zoom: BoundaryStore(simplified_frame(lod, tolerance_for_zoom(zoom)))
+            for zoom in [11, 12]
+        },
+        "topology": process_topology(tolerance_for_zoom(11), gdf),
+    }
+
+
+# prepared views, shared by every session so a popular view is only built once
+@st.cache_resource(show_spinner=False)
+def load_map_cache():
+    return MapCache()
+
+
+# VECTOR_TILES=1 draws the full maps and change fragments from vector tiles served on a
+# local port, so a page carries no boundary geometry; the browser has to reach that port
+@st.cache_resource(show_spinner=False)
+def load_tile_server():
+    data = load_data()
+    process_tiles(data["store"].gdf, data["overlay"], data["compactness"])
+    return start_tile_server()
+
+
+def build_panels(data, tile_url, key):
+    # prepared panels for one view key, as laid out in view_key below
+    baseline_year, compare_year, compare_type, constituency, map_chosen, metric = key
+    # simplified boundaries for the zoom the maps open at; full map at 11, constituency views at 12
+    zoom_start = 11 if compare_type == "Full Map" else 12
+    with stage("build_view", compare_type=compare_type):
+        panels = build_view(
+            data["display"][zoom_start],
+            data["overlay"],
+            data["lineage"],
+            data["topology"],
+            baseline_year,
+            compare_year,
+            compare_type,
+            constituency,
+            data["compactness"],
+            metric,
+            tile_url,
+        )
+    with stage("prepare_maps"):
+        return prepare_panels(panels, map_chosen)
+
+
+def warmup_keys(store, tiles="CartoDB positron"):
+    # (priority, view key) of the views a visitor is most likely to open, on the default
+    # map tiles and without metric colouring: every full map pair, nearest years and the
+    # latest first, then each constituency's changes between two years it exists in
+    index = {year: i for i, year in enumerate(sorted(store.years, reverse=True))}
+
+    def order(pair):
+        gap = abs(index[pair[0]] - index[pair[1]])
+        return gap == 0, gap, min(index[pair[0]], index[pair[1]]), pair[0] > pair[1]
+
+    pairs = sorted(itertools.product(index, index), key=order)
+    for baseline_year, compare_year in pairs:
+        yield FULL_MAP, (baseline_year, compare_year, "Full Map", None, tiles, None)
+
+    for baseline_year, compare_year in pairs:
+        if baseline_year == compare_year:
+            continue
+        for constituency in store.constituencies:
+            if len(store.constituency_frame(baseline_year, constituency)) and len(
+                store.constituency_frame(compare_year, constituency)
+            ):
+                yield CHANGES, (
+                    baseline_year,
+                    compare_year,
+                    "Constituency Changes Year over Year",
+                    constituency,
+                    tiles,
+                    None,
+                )
 
-gdf = process()
+
+# WARMUP=0 turns off building likely views in the background after startup
+@st.cache_resource(show_spinner=False)
+def load_warmup(tile_url):
+    warmup = Warmup(load_map_cache(), retained_size)
+    if os.environ.get("WARMUP") != "0":
+        data = load_data()
+        for priority, key in warmup_keys(data["store"]):
+            warmup.submit(
+                key, functools.partial(build_panels, data, tile_url, key), priority
+            )
+        warmup.start()
+    return warmup
 
 
 st.set_page_config(layout="wide")
+
+# ?debug=1 shows this run's stage timings, payload sizes and cache hit rates in the sidebar,
+# with an opt-in cProfile capture of the whole run
+debug = st.query_params.get("debug") == "1"
+profiler = None
+if debug and st.sidebar.checkbox("Profile this run (cProfile)"):
+    profiler = start_profile()
+
+start_run()
+
+with stage("load_data"):
+    data = load_data()
+store = data["store"]
+map_cache = load_map_cache()
+tile_url = load_tile_server() if os.environ.get("VECTOR_TILES") == "1" else None
+warmup = load_warmup(tile_url)
+
 st.title("Electoral Boundary")
 
 st.write(
@@ -23,14 +174,12 @@ st.write(
 # year selection for baseline reference
 baseline_year = st.selectbox(
     "Select the year as baseline",
-    (gdf["year"].unique()),
+    store.years,
     index=None,
 )
 
 # year selection for comparison against baseline reference
-compare_year = st.selectbox(
-    "Select the year for comparison", (gdf["year"].unique()), index=None
-)
+compare_year = st.selectbox("Select the year for comparison", store.years, index=None)
 
 
 if baseline_year and compare_year:
@@ -44,16 +193,12 @@ if baseline_year and compare_year:
     )
     compare_type = st.radio(
         "Select type of comparison",
-        [
-            "Full Map",
-            "Constituency Year vs Year",
-            "Constituency Changes Year over Year",
-        ],
+        COMPARE_TYPES,
         help=help_text,
         horizontal=True,
     )
 
-    constituency_list = sorted(gdf["ED_DESC"].unique().tolist())
+    constituency_list = store.constituencies
 
     if compare_type == "Full Map":
         constituency = None
@@ -73,543 +218,115 @@ if baseline_year and compare_year:
 
         map_chosen = map[map_setting]
 
-        gdf_baseline = (
-            gdf[(gdf["year"] == baseline_year) & (gdf["ED_DESC"] == constituency)]
-            .copy()
-            .reset_index(drop=True)
-        )
-        gdf_compare_all = (
-            gdf[(gdf["year"] == compare_year)].copy().reset_index(drop=True)
-        )
-
-        gdf_compare = (
-            gdf[(gdf["year"] == compare_year) & (gdf["ED_DESC"] == constituency)]
-            .copy()
-            .reset_index(drop=True)
-        )
-
-        gdf_baseline_all = (
-            gdf[(gdf["year"] == baseline_year)].copy().reset_index(drop=True)
+        # optionally colour the full maps by a compactness metric
+        metric = None
+        if compare_type == "Full Map":
+            metric_names = {name: metric for metric, name in METRICS.items()}
+            colour_by = st.radio(
+                "Colour constituencies by",
+                ["None"] + list(metric_names),
+                index=0,
+                horizontal=True,
+            )
+            metric = metric_names.get(colour_by)
+
+        view_key = (
+            baseline_year,
+            compare_year,
+            compare_type,
+            constituency,
+            map_chosen,
+            metric,
         )
-
-        # COMPUTE AREAS THAT WERE REMOVED (from baseline reference year)
-        if len(gdf_baseline) > 0:
-            scale_intersect_idx, intersect_polygon, ed_desc = compute_intersect(
-                gdf_compare_all, gdf_baseline, constituency
+        with stage("view", compare_type=compare_type) as view_stage:
+            prepared = warmup.get(
+                view_key, functools.partial(build_panels, data, tile_url, view_key)
             )
+            # bytes of layer text the page embeds, and what the cache charges for the view
+            # (an estimate, and None when the view was not kept)
+            view_stage["payload_bytes"] = layer_payloads(prepared)
+            view_stage["retained_bytes"] = map_cache.nbytes(view_key)
 
-            # convert to geodataframe
-            intersected_gpd = gpd.GeoDataFrame(
-                {"ED_DESC": ed_desc, "geometry": intersect_polygon}, crs="4326"
-            )
+        # the cache holds only the serialized layers; rendering writes to a folium.Map, so
+        # every run gets maps of its own
+        with stage("render_maps"):
+            panels = assemble_panels(prepared)
 
-            # get constituency info
-            intersected_gpd = intersected_gpd.merge(
-                gdf_compare_all[
-                    ["year", "ED_DESC", "constituency_type", "pax_number", "result"]
-                ],
-                how="left",
-                on=["ED_DESC"],
-            )
-        else:
-            # if the constituency does not exist in baseline year, we find the equivalence of the GRC/SMC
-            scale_intersect_idx, intersect_polygon, ed_desc = compute_intersect(
-                gdf_baseline_all, gdf_compare, constituency
-            )
-            # convert to geodataframe
-            old_areas_gpd = gdf_baseline_all.iloc[scale_intersect_idx]
+        col1, col2 = st.columns(2)
 
-        # COMPUTE AREAS THAT WERE ADDED (to baseline reference year to get compare year boundary)
-        if len(gdf_compare) > 0:
-            scale_intersect_idx, intersect_polygon, ed_desc = compute_intersect(
-                gdf_baseline_all, gdf_compare, constituency
-            )
+        for col, panel in zip([col1, col2], panels):
+            with col:
+                st.write(panel["text"])
+                if panel["map"]:
+                    with stage("st_folium", key=panel["key"]):
+                        st_folium(
+                            panel["map"],
+                            width=650,
+                            height=550,
+                            returned_objects=[],
+                            key=panel["key"],
+                        )
 
-            # convert to geodataframe
-            intersected_gpd_added = gpd.GeoDataFrame(
-                {"ED_DESC": ed_desc, "geometry": intersect_polygon}, crs="4326"
+        # area moved between the two years' constituencies; rows are baseline, columns comparison
+        with st.expander(
+            "Area transferred from {} to {} constituencies (km²)".format(
+                baseline_year, compare_year
             )
+        ):
+            with stage("transfer_matrix"):
+                st.dataframe(
+                    (
+                        transfer_matrix(data["transfers"], baseline_year, compare_year)
+                        / 1e6
+                    ).round(3)
+                )
 
-            # get constituency info
-            intersected_gpd_added = intersected_gpd_added.merge(
-                gdf_baseline_all[
-                    ["year", "ED_DESC", "constituency_type", "pax_number", "result"]
-                ],
-                how="left",
-                on=["ED_DESC"],
+        # shape metrics of both years' constituencies; click a column header to sort
+        with st.expander(
+            "Compactness of {} and {} constituencies".format(
+                baseline_year, compare_year
             )
-        else:
-            # if the constituency does not exist in baseline year, we find the equivalence of the GRC/SMC
-            scale_intersect_idx, intersect_polygon, ed_desc = compute_intersect(
-                gdf_compare_all, gdf_baseline, constituency
+        ):
+            compactness = data["compactness"]
+            st.dataframe(
+                compactness[
+                    compactness["year"].isin([baseline_year, compare_year])
+                ].round(3),
+                hide_index=True,
+                column_config={
+                    column: st.column_config.NumberColumn(name)
+                    for column, name in METRICS.items()
+                },
             )
-            # convert to geodataframe
-            new_areas_gpd = gdf_compare_all.iloc[scale_intersect_idx]
-
-        # intersected_gpd.area
-        col1, col2 = st.columns(2)
-
-        with col1:
-            if compare_type == "Constituency Year vs Year":
-                if len(gdf_baseline) == 0 and len(gdf_compare) == 0:
-                    st.write("No such constituency in year {}".format(baseline_year))
-                elif len(gdf_baseline) == 0 and len(gdf_compare) > 0:
-                    st.write(
-                        "No such constituency in year {}. Showing the GRC/SMC that bounded the same area.".format(
-                            baseline_year
-                        )
-                    )
-                    m_chosen = folium.Map(
-                        location=[
-                            old_areas_gpd.geometry.centroid.y.mean(),
-                            old_areas_gpd.geometry.centroid.x.mean(),
-                        ],
-                        zoom_start=12,
-                        max_zoom=21,
-                        tiles=map_chosen,  # Use a greyscale tile layer
-                    )
-
-                    tooltip = GeoJsonTooltip(
-                        fields=[
-                            "year",
-                            "ED_DESC",
-                            "constituency_type",
-                            "pax_number",
-                            "result",
-                        ],
-                        aliases=["Year: ", "ED: ", "Type: ", "Pax: ", "Result: "],
-                        localize=True,
-                        sticky=True,
-                        labels=True,
-                        style="""
-                    background-color: #F0EFEF;
-                    border: 2px solid black;
-                    border-radius: 3px;
-                    box-shadow: 3px;
-                """,
-                        max_width=300,
-                    )
-
-                    folium.GeoJson(old_areas_gpd, tooltip=tooltip).add_to(m_chosen)
-
-                    st_folium(
-                        m_chosen,
-                        width=650,
-                        height=550,
-                        returned_objects=[],
-                        # feature_group_to_add=fg_dict[fg],
-                        # debug=True,
-                        # layer_control=layer_dict[layer],
-                        key="map1.1",
-                    )
-                else:
-                    st.write("Electoral Boundaries for Year {}".format(baseline_year))
-                    m_chosen = folium.Map(
-                        location=[
-                            gdf_baseline.geometry.centroid.y.mean(),
-                            gdf_baseline.geometry.centroid.x.mean(),
-                        ],
-                        zoom_start=12,
-                        max_zoom=21,
-                        tiles=map_chosen,  # Use a greyscale tile layer
-                    )
-
-                    tooltip = GeoJsonTooltip(
-                        fields=[
-                            "year",
-                            "ED_DESC",
-                            "constituency_type",
-                            "pax_number",
-                            "result",
-                        ],
-                        aliases=["Year: ", "ED: ", "Type: ", "Pax: ", "Result: "],
-                        localize=True,
-                        sticky=True,
-                        labels=True,
-                        style="""
-                    background-color: #F0EFEF;
-                    border: 2px solid black;
-                    border-radius: 3px;
-                    box-shadow: 3px;
-                """,
-                        max_width=300,
-                    )
-
-                    folium.GeoJson(gdf_baseline, tooltip=tooltip).add_to(m_chosen)
-
-                    st_folium(
-                        m_chosen,
-                        width=650,
-                        height=550,
-                        returned_objects=[],
-                        # feature_group_to_add=fg_dict[fg],
-                        # debug=True,
-                        # layer_control=layer_dict[layer],
-                        key="map1",
-                    )
-            elif compare_type == "Constituency Changes Year over Year":
-                if len(gdf_baseline) == 0:
-                    st.write("No such constituency in year {}.".format(baseline_year))
-                elif len(gdf_baseline) > 0:  # and len(gdf_compare) == 0:
-                    st.write("Electoral Boundaries for Year {}".format(baseline_year))
-                    m = folium.Map(
-                        location=[
-                            gdf_baseline.geometry.centroid.y.mean(),
-                            gdf_baseline.geometry.centroid.x.mean(),
-                        ],
-                        zoom_start=12,
-                        max_zoom=21,
-                        tiles=map_chosen,
-                    )
-
-                    tooltip = GeoJsonTooltip(
-                        fields=[
-                            "year",
-                            "ED_DESC",
-                            "constituency_type",
-                            "pax_number",
-                            "result",
-                        ],
-                        aliases=["Year: ", "ED: ", "Type: ", "Pax: ", "Result: "],
-                        localize=True,
-                        sticky=True,
-                        labels=True,
-                        style="""
-                  background-color: #F0EFEF;
-                  border: 2px solid black;
-                  border-radius: 3px;
-                  box-shadow: 3px;
-              """,
-                        max_width=300,
-                    )
-
-                    folium.GeoJson(gdf_baseline, tooltip=tooltip).add_to(m)
-
-                    st_folium(
-                        m,
-                        width=650,
-                        height=550,
-                        returned_objects=[],
-                        # feature_group_to_add=fg_dict[fg],
-                        # debug=True,
-                        # layer_control=layer_dict[layer],
-                        key="map2.1",
-                    )
-            elif compare_type == "Full Map":
-                st.write("Full Electoral Boundaries for Year {}".format(baseline_year))
-                m = folium.Map(
-                    location=[
-                        gdf_baseline_all.geometry.centroid.y.mean(),
-                        gdf_baseline_all.geometry.centroid.x.mean(),
-                    ],
-                    zoom_start=11,
-                    max_zoom=21,
-                    tiles=map_chosen,
-                )
-
-                tooltip = GeoJsonTooltip(
-                    fields=[
-                        "year",
-                        "ED_DESC",
-                        "constituency_type",
-                        "pax_number",
-                        "result",
-                    ],
-                    aliases=["Year: ", "ED: ", "Type: ", "Pax: ", "Result: "],
-                    localize=True,
-                    sticky=True,
-                    labels=True,
-                    style="""
-                background-color: #F0EFEF;
-                border: 2px solid black;
-                border-radius: 3px;
-                box-shadow: 3px;
-            """,
-                    max_width=300,
-                )
 
-                folium.GeoJson(gdf_baseline_all, tooltip=tooltip).add_to(m)
-
-                st_folium(
-                    m,
-                    width=650,
-                    height=550,
-                    returned_objects=[],
-                    # feature_group_to_add=fg_dict[fg],
-                    # debug=True,
-                    # layer_control=layer_dict[layer],
-                    key="map2.2",
+        # baseline votes and electors moved onto the comparison year's boundaries by area
+        with st.expander(
+            "Notional {} results on {} boundaries (vote share %)".format(
+                baseline_year, compare_year
+            )
+        ):
+            with stage("notional_table"):
+                st.dataframe(
+                    notional_table(
+                        *data["notional"], baseline_year, compare_year
+                    ).round(1)
                 )
 
-        with col2:
-            if compare_type == "Constituency Year vs Year":
-                if len(gdf_compare) == 0 and len(gdf_baseline) == 0:
-                    st.write("No such constituency in year {}".format(compare_year))
-                elif len(gdf_compare) == 0 and len(gdf_baseline) > 0:
-                    st.write(
-                        "No such constituency in year {}. Showing the GRC/SMC that bounded the same area.".format(
-                            compare_year
-                        )
-                    )
-                    m_chosen = folium.Map(
-                        location=[
-                            new_areas_gpd.geometry.centroid.y.mean(),
-                            new_areas_gpd.geometry.centroid.x.mean(),
-                        ],
-                        zoom_start=12,
-                        max_zoom=21,
-                        tiles=map_chosen,  # Use a greyscale tile layer
-                    )
-
-                    tooltip = GeoJsonTooltip(
-                        fields=[
-                            "year",
-                            "ED_DESC",
-                            "constituency_type",
-                            "pax_number",
-                            "result",
-                        ],
-                        aliases=["Year: ", "ED: ", "Type: ", "Pax: ", "Result: "],
-                        localize=True,
-                        sticky=True,
-                        labels=True,
-                        style="""
-                    background-color: #F0EFEF;
-                    border: 2px solid black;
-                    border-radius: 3px;
-                    box-shadow: 3px;
-                """,
-                        max_width=300,
-                    )
-
-                    folium.GeoJson(new_areas_gpd, tooltip=tooltip).add_to(m_chosen)
-
-                    st_folium(
-                        m_chosen,
-                        width=650,
-                        height=550,
-                        returned_objects=[],
-                        # feature_group_to_add=fg_dict[fg],
-                        # debug=True,
-                        # layer_control=layer_dict[layer],
-                        key="map1.1",
-                    )
-                else:
-                    st.write("Electoral Boundaries for Year {}".format(compare_year))
-                    m = folium.Map(
-                        location=[
-                            gdf_compare.geometry.centroid.y.mean(),
-                            gdf_compare.geometry.centroid.x.mean(),
-                        ],
-                        zoom_start=12,
-                        max_zoom=21,
-                        tiles=map_chosen,
-                    )
-
-                    tooltip = GeoJsonTooltip(
-                        fields=[
-                            "year",
-                            "ED_DESC",
-                            "constituency_type",
-                            "pax_number",
-                            "result",
-                        ],
-                        aliases=["Year: ", "ED: ", "Type: ", "Pax: ", "Result: "],
-                        localize=True,
-                        sticky=True,
-                        labels=True,
-                        style="""
-                  background-color: #F0EFEF;
-                  border: 2px solid black;
-                  border-radius: 3px;
-                  box-shadow: 3px;
-              """,
-                        max_width=300,
-                    )
-
-                    folium.GeoJson(gdf_compare, tooltip=tooltip).add_to(m)
-
-                    st_folium(
-                        m,
-                        width=650,
-                        height=550,
-                        returned_objects=[],
-                        # feature_group_to_add=fg_dict[fg],
-                        # debug=True,
-                        # layer_control=layer_dict[layer],
-                        key="map2.1",
-                    )
-
-            elif compare_type == "Constituency Changes Year over Year":
-                if len(gdf_compare) == 0:
-                    st.write("No such constituency in year {}.".format(compare_year))
-                elif len(gdf_baseline) == 0 and len(gdf_compare) > 0:
-                    st.write("Electoral Boundaries for Year {}".format(compare_year))
-                    m = folium.Map(
-                        location=[
-                            gdf_compare.geometry.centroid.y.mean(),
-                            gdf_compare.geometry.centroid.x.mean(),
-                        ],
-                        zoom_start=12,
-                        max_zoom=21,
-                        tiles=map_chosen,
-                    )
-
-                    tooltip = GeoJsonTooltip(
-                        fields=[
-                            "year",
-                            "ED_DESC",
-                            "constituency_type",
-                            "pax_number",
-                            "result",
-                        ],
-                        aliases=["Year: ", "ED: ", "Type: ", "Pax: ", "Result: "],
-                        localize=True,
-                        sticky=True,
-                        labels=True,
-                        style="""
-                  background-color: #F0EFEF;
-                  border: 2px solid black;
-                  border-radius: 3px;
-                  box-shadow: 3px;
-              """,
-                        max_width=300,
-                    )
-
-                    folium.GeoJson(gdf_compare, tooltip=tooltip).add_to(m)
-
-                    st_folium(
-                        m,
-                        width=650,
-                        height=550,
-                        returned_objects=[],
-                        # feature_group_to_add=fg_dict[fg],
-                        # debug=True,
-                        # layer_control=layer_dict[layer],
-                        key="map2.1",
-                    )
-                else:
-                    st.write(
-                        "Electoral Boundaries Changes from {} to {}".format(
-                            baseline_year, compare_year
-                        )
-                    )
-                    m = folium.Map(
-                        location=[
-                            gdf_baseline.geometry.centroid.y.mean(),
-                            gdf_baseline.geometry.centroid.x.mean(),
-                        ],
-                        zoom_start=12,
-                        max_zoom=21,
-                        tiles=map_chosen,
-                    )
-
-                    tooltip1 = GeoJsonTooltip(
-                        fields=[
-                            "year",
-                            "ED_DESC",
-                            "constituency_type",
-                            "pax_number",
-                            "result",
-                        ],
-                        aliases=["Year: ", "ED: ", "Type: ", "Pax: ", "Result: "],
-                        localize=True,
-                        sticky=True,
-                        labels=True,
-                        style="""
-                  background-color: #F0EFEF;
-                  border: 2px solid black;
-                  border-radius: 3px;
-                  box-shadow: 3px;
-              """,
-                        max_width=300,
-                    )
-
-                    tooltip2 = GeoJsonTooltip(
-                        fields=[
-                            "year",
-                            "ED_DESC",
-                            "constituency_type",
-                            "pax_number",
-                            "result",
-                        ],
-                        aliases=["Year: ", "ED: ", "Type: ", "Pax: ", "Result: "],
-                        localize=True,
-                        sticky=True,
-                        labels=True,
-                        style="""
-                  background-color: #F0EFEF;
-                  border: 2px solid black;
-                  border-radius: 3px;
-                  box-shadow: 3px;
-              """,
-                        max_width=300,
-                    )
-
-                    folium.GeoJson(
-                        intersected_gpd, tooltip=tooltip1, name="m1", color="red"
-                    ).add_to(m)
-
-                    if (len(gdf_compare)) > 0:
-                        folium.GeoJson(
-                            intersected_gpd_added,
-                            tooltip=tooltip2,
-                            name="m2",
-                            color="green",
-                        ).add_to(m)
-
-                    st_folium(
-                        m,
-                        width=650,
-                        height=550,
-                        returned_objects=[],
-                        # feature_group_to_add=fg_dict[fg],
-                        # debug=True,
-                        # layer_control=layer_dict[layer],
-                        key="map2.2",
-                    )
-            elif compare_type == "Full Map":
-                st.write("Full Electoral Boundaries for Year {}".format(compare_year))
-                m = folium.Map(
-                    location=[
-                        gdf_compare_all.geometry.centroid.y.mean(),
-                        gdf_compare_all.geometry.centroid.x.mean(),
-                    ],
-                    zoom_start=11,
-                    max_zoom=21,
-                    tiles=map_chosen,
-                )
+record("map_cache", **map_cache.stats())
+record("warmup", **warmup.stats())
 
-                tooltip = GeoJsonTooltip(
-                    fields=[
-                        "year",
-                        "ED_DESC",
-                        "constituency_type",
-                        "pax_number",
-                        "result",
-                    ],
-                    aliases=["Year: ", "ED: ", "Type: ", "Pax: ", "Result: "],
-                    localize=True,
-                    sticky=True,
-                    labels=True,
-                    style="""
-                background-color: #F0EFEF;
-                border: 2px solid black;
-                border-radius: 3px;
-                box-shadow: 3px;
-            """,
-                    max_width=300,
-                )
+if profiler is not None:
+    st.sidebar.write("Profile written to {}".format(stop_profile(profiler)))
 
-                folium.GeoJson(gdf_compare_all, tooltip=tooltip).add_to(m)
-
-                st_folium(
-                    m,
-                    width=650,
-                    height=550,
-                    returned_objects=[],
-                    # feature_group_to_add=fg_dict[fg],
-                    # debug=True,
-                    # layer_control=layer_dict[layer],
-                    key="map2.3",
-                )
+if debug:
+    st.sidebar.subheader("Stages")
+    st.sidebar.dataframe(
+        pd.DataFrame(
+            [r for r in run_records() if r["stage"] not in ("map_cache", "warmup")]
+        ).drop(columns=["time", "run"]),
+        hide_index=True,
+    )
+    st.sidebar.subheader("Map cache")
+    st.sidebar.json(map_cache.stats())
+    st.sidebar.subheader("Warm-up")
+    st.sidebar.json(warmup.stats())
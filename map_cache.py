@@ -0,0 +1,74 @@
+import threading
+from collections import OrderedDict
+
+
+class MapCache:
+    # bounded LRU of built views shared by every session in the process, so values must
+    # not be modified once cached; each entry is charged the bytes its caller says it keeps
+    # alive (for the dashboard, views.retained_size of the prepared panels), and the least
+    # recently used entries are dropped once the total goes over max_bytes
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, build, size):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+
+        # build outside the lock so one slow view does not block the others;
+        # two sessions missing on the same key at once both build it, and the last one wins
+        value = build()
+        self.put(key, value, size(value))
+        return value
+
+    def put(self, key, value, nbytes):
+        # store a value built elsewhere, e.g. ahead of time; an entry larger than the whole
+        # cache is not kept
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+
+            if nbytes <= self.max_bytes:
+                self._entries[key] = (value, nbytes)
+                self.bytes += nbytes
+                while self.bytes > self.max_bytes:
+                    _, (_, evicted) = self._entries.popitem(last=False)
+                    self.bytes -= evicted
+                    self.evictions += 1
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def nbytes(self, key):
+        # size charged for a cached entry, None if it is not (or no longer) cached
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from constituency_processing import RESULTS_FILE, ed_names, load_constituency_info
+
+
+def load_votes():
+    # votes per party per constituency; walkovers have no votes and are left out
+    results = pd.read_csv(RESULTS_FILE)
+    results = results[results["vote_count"] != "na"]
+    return pd.DataFrame(
+        {
+            "year": results["year"].astype(str),
+            "ED_DESC": ed_names(results["constituency"]),
+            "party": results["party"],
+            "votes": results["vote_count"].astype(float),
+        }
+    ).reset_index(drop=True)
+
+
+def load_electors():
+    info = load_constituency_info()
+    return pd.DataFrame(
+        {
+            "year": info["year"],
+            "ED_DESC": info["ED_DESC"],
+            "electors": info["registered_electors"].astype(float),
+        }
+    )
+
+
+def overlap_weights(transfers, year, other_year):
+    # sparse N x M matrix of the share of each `year` constituency (rows) lying in each
+    # `other_year` constituency (columns), normalised so every row sums to 1; also returns
+    # the raw areas and the row/column constituency names
+    pair = transfers[
+        (transfers["year"] == year) & (transfers["other_year"] == other_year)
+    ]
+    source = pd.Categorical(pair["ED_DESC"])
+    target = pd.Categorical(pair["other_ED_DESC"])
+
+    area = sparse.csr_matrix(
+        (pair["area"].to_numpy(), (source.codes, target.codes)),
+        shape=(len(source.categories), len(target.categories)),
+    )
+    weights = sparse.diags(1 / np.asarray(area.sum(axis=1)).ravel()) @ area
+    return weights, area, source.categories, target.categories
+
+
+def source_matrix(frame, year, rows, column, value):
+    # sparse (constituency x `column`) matrix of `value` for one year, rows aligned with `rows`
+    frame = frame[frame["year"] == year]
+    row = pd.Categorical(frame["ED_DESC"], categories=rows).codes
+    col = pd.Categorical(frame[column])
+    keep = row >= 0
+
+    matrix = sparse.csr_matrix(
+        (frame[value].to_numpy()[keep], (row[keep], col.codes[keep])),
+        shape=(len(rows), len(col.categories)),
+    )
+    return matrix, col.categories
+
+
+def reapportion(transfers, votes, electors, year, other_year):
+    # `year` votes and electors moved onto `other_year` boundaries in proportion to area
+    weights, area, sources, targets = overlap_weights(transfers, year, other_year)
+
+    vote_matrix, parties = source_matrix(votes, year, sources, "party", "votes")
+    notional = (weights.T @ vote_matrix).tocoo()
+
+    # one value per source constituency, NaN where the year (e.g. a newly added one) has
+    # no electors yet; only stored weights multiply, so a NaN reaches just the
+    # constituencies that overlap it
+    source_electors = (
+        electors[electors["year"] == year]
+        .groupby("ED_DESC")["electors"]
+        .sum()
+        .reindex(sources)
+        .to_numpy(dtype=float)
+    )
+    notional_electors = weights.T @ source_electors
+
+    # share of each new constituency's area whose old constituency was contested;
+    # unknown when the year has no results at all
+    target_area = np.asarray(area.sum(axis=0)).ravel()
+    if len(parties):
+        contested = np.asarray(vote_matrix.sum(axis=1)).ravel() > 0
+        contested_area = area.T @ contested.astype(float)
+    else:
+        contested_area = np.full(len(targets), np.nan)
+
+    notional_votes = pd.DataFrame(
+        {
+            "year": year,
+            "other_year": other_year,
+            "ED_DESC": np.asarray(targets)[notional.row],
+            "party": np.asarray(parties)[notional.col],
+            "votes": notional.data,
+        }
+    )
+    notional_constituencies = pd.DataFrame(
+        {
+            "year": year,
+            "other_year": other_year,
+            "ED_DESC": np.asarray(targets),
+            "electors": notional_electors,
+            "contested_area_share": contested_area / target_area,
+        }
+    )
+    return notional_votes, notional_constituencies
+
+
+def compute_notional(transfers, votes=None, electors=None):
+    # notional results of every election year on every other year's boundaries;
+    # row `year` is the election, `other_year` and ED_DESC the boundaries it is redrawn on
+    if votes is None:
+        votes = load_votes()
+    if electors is None:
+        electors = load_electors()
+
+    pairs = transfers[["year", "other_year"]].drop_duplicates()
+    results = [
+        reapportion(transfers, votes, electors, year, other_year)
+        for year, other_year in pairs.itertuples(index=False)
+    ]
+
+    notional_votes = pd.concat([votes for votes, _ in results], ignore_index=True)
+    notional_votes["vote_share"] = notional_votes["votes"] / notional_votes.groupby(
+        ["year", "other_year", "ED_DESC"]
+    )["votes"].transform("sum")
+
+    notional_constituencies = pd.concat(
+        [constituencies for _, constituencies in results], ignore_index=True
+    )
+    return notional_votes, notional_constituencies
+
+
+def notional_table(notional_votes, notional_constituencies, year, other_year):
+    # one row per `other_year` constituency: vote share (%) per party and notional electors
+    pair_votes = notional_votes[
+        (notional_votes["year"] == year) & (notional_votes["other_year"] == other_year)
+    ]
+    pair_constituencies = notional_constituencies[
+        (notional_constituencies["year"] == year)
+        & (notional_constituencies["other_year"] == other_year)
+    ].set_index("ED_DESC")
+
+    shares = 100 * pair_votes.pivot_table(
+        index="ED_DESC", columns="party", values="vote_share", aggfunc="sum"
+    )
+    table = pair_constituencies[["electors", "contested_area_share"]].join(shares)
+    table["contested_area_share"] = 100 * table["contested_area_share"]
+    return table.rename(columns={"contested_area_share": "contested_area_pct"})
@@ -0,0 +1,195 @@
+import argparse
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+
+from data_processing import process
+
+# per-process lookup trees, built once by each worker
+state = {}
+
+
+def build_trees(gdf):
+    # one STRtree per year over prepared polygons, so every point test reuses the prepared geometry
+    trees = {}
+    for year in sorted(gdf["year"].unique()):
+        gdf_year = gdf[gdf["year"] == year]
+        polygons = np.asarray(gdf_year.geometry.values)
+        shapely.prepare(polygons)
+        trees[year] = (
+            shapely.STRtree(polygons),
+            polygons,
+            gdf_year["ED_DESC"].to_numpy(),
+        )
+    return trees
+
+
+def lookup_points(lon, lat, trees):
+    # ED_DESC of every point for every year; None where the point falls outside all constituencies
+    points = shapely.points(np.asarray(lon, dtype=float), np.asarray(lat, dtype=float))
+    result = {}
+
+    for year, (tree, polygons, names) in trees.items():
+        # envelope candidates from the tree, then the exact test against the prepared polygon
+        point_idx, polygon_idx = tree.query(points)
+        hit = shapely.intersects(polygons[polygon_idx], points[point_idx])
+        point_idx, polygon_idx = point_idx[hit], polygon_idx[hit]
+
+        # a point on a shared boundary touches two constituencies; keep the first one
+        point_idx, first = np.unique(point_idx, return_index=True)
+
+        ed_desc = np.full(len(points), None, dtype=object)
+        ed_desc[point_idx] = names[polygon_idx[first]]
+        result["ED_DESC_{}".format(year)] = ed_desc
+
+    return pd.DataFrame(result)
+
+
+def input_schema(path, lon="lon", lat="lat"):
+    # arrow types of the input columns, one set for the whole file; a CSV has no types of
+    # its own, so everything but the coordinates is kept as text
+    if path.endswith(".parquet"):
+        return pq.ParquetFile(path).schema_arrow
+    return pa.schema(
+        [
+            (column, pa.float64() if column in (lon, lat) else pa.string())
+            for column in pd.read_csv(path, nrows=0).columns
+        ]
+    )
+
+
+def read_chunks(path, chunksize, schema):
+    if path.endswith(".parquet"):
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        # read with the schema's types rather than inferred per chunk, which could differ
+        # from one chunk to the next
+        dtype = {
+            field.name: float if pa.types.is_floating(field.type) else str
+            for field in schema
+        }
+        yield from pd.read_csv(path, chunksize=chunksize, dtype=dtype)
+
+
+def lookup_chunk(chunk, lon, lat):
+    if not state:
+        state["trees"] = build_trees(process())
+
+    result = lookup_points(chunk[lon], chunk[lat], state["trees"])
+    result.index = chunk.index
+    return pd.concat([chunk, result], axis=1)
+
+
+class ChunkWriter:
+    # appends result chunks to a CSV or Parquet file; a Parquet file is written with the
+    # input columns' schema, plus the ED_DESC_<year> columns as strings
+    def __init__(self, path, schema):
+        self.path = path
+        self.schema = schema
+        self.parquet = None
+        self.first = True
+
+    def write(self, chunk):
+        if self.path.endswith(".parquet"):
+            if self.parquet is None:
+                self.schema = pa.schema(
+                    [
+                        (
+                            self.schema.field(column)
+                            if column in self.schema.names
+                            else pa.field(column, pa.string())
+                        )
+                        for column in chunk.columns
+                    ]
+                )
+            # converted to the fixed schema, not inferred per chunk: pandas turns an int
+            # column with nulls into floats, and a year with no hits is all None
+            table = pa.Table.from_pandas(
+                chunk, schema=self.schema, preserve_index=False
+            )
+            if self.parquet is None:
+                self.parquet = pq.ParquetWriter(self.path, table.schema)
+            self.parquet.write_table(table)
+        else:
+            chunk.to_csv(
+                self.path,
+                mode="w" if self.first else "a",
+                header=self.first,
+                index=False,
+            )
+        self.first = False
+
+    def close(self):
+        if self.parquet is not None:
+            self.parquet.close()
+
+
+def assign_file(
+    input_path, output_path, lon="lon", lat="lat", chunksize=500000, workers=1
+):
+    # stream the input in chunks so memory stays bounded by a few chunks, not the file size
+    schema = input_schema(input_path, lon, lat)
+    writer = ChunkWriter(output_path, schema)
+    rows = 0
+
+    try:
+        if workers == 1:
+            for chunk in read_chunks(input_path, chunksize, schema):
+                writer.write(lookup_chunk(chunk, lon, lat))
+                rows += len(chunk)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                # keep at most two chunks per worker in flight, written back in input order
+                pending = deque()
+                for chunk in read_chunks(input_path, chunksize, schema):
+                    pending.append(executor.submit(lookup_chunk, chunk, lon, lat))
+                    if len(pending) >= 2 * workers:
+                        result = pending.popleft().result()
+                        writer.write(result)
+                        rows += len(result)
+                while pending:
+                    result = pending.popleft().result()
+                    writer.write(result)
+                    rows += len(result)
+    finally:
+        writer.close()
+
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Assign lat/lon points in a CSV or Parquet file to their electoral division for every year."
+    )
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--lon", default="lon", help="longitude column")
+    parser.add_argument("--lat", default="lat", help="latitude column")
+    parser.add_argument("--chunksize", type=int, default=500000)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    # build the boundary cache once before any worker starts
+    process()
+
+    start = time.perf_counter()
+    rows = assign_file(
+        args.input, args.output, args.lon, args.lat, args.chunksize, args.workers
+    )
+    elapsed = time.perf_counter() - start
+    print(
+        "assigned {} points in {:.1f}s ({:.0f} points/min)".format(
+            rows, elapsed, 60 * rows / elapsed
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+import geopandas as gpd
+import numpy as np
+import shapely
+
+# boundaries are snapped to this grid in SVY21 (EPSG:3414), in metres
+PRECISION_GRID = 0.1
+
+
+def normalize_geometries(geometry, grid=PRECISION_GRID):
+    # 2D polygons snapped to `grid` metres in SVY21, without collinear vertices, and with
+    # invalid rings repaired; returned in the input CRS. neighbours snap to the same grid
+    # points, so shared edges stay shared. simplifying with any tolerance above 0 would
+    # break that: each polygon is simplified on its own, and neighbours drop different
+    # vertices of the edge they share
+    svy21 = shapely.force_2d(np.asarray(geometry.to_crs(3414).values))
+    svy21 = shapely.set_precision(svy21, grid)
+    svy21 = shapely.simplify(svy21, 0)
+    svy21 = shapely.make_valid(svy21)
+    return gpd.GeoSeries(svy21, index=geometry.index, crs=3414).to_crs(geometry.crs)
+
+
+def overlap_area(geometry):
+    # total area, in the units of geometry's CRS, where two of its polygons overlap;
+    # 0 for a clean set of neighbouring boundaries
+    geometry = np.asarray(geometry.values)
+    left, right = shapely.STRtree(geometry).query(geometry, predicate="intersects")
+    pairs = left < right
+    return float(
+        shapely.area(
+            shapely.intersection(geometry[left[pairs]], geometry[right[pairs]])
+        ).sum()
+    )
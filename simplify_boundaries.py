@@ -0,0 +1,80 @@
+import math
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from data_processing import boundary_keys, process, read_cache, write_cache
+
+SIMPLIFY_VERSION = 2
+
+# simplification tolerances in metres (EPSG:3414); 0 keeps the full-resolution boundary
+TOLERANCES = [0, 5, 10, 20, 50]
+
+
+def simplify_boundaries(gdf, tolerances=TOLERANCES):
+    # each year's constituencies form a polygonal coverage, so simplifying them together
+    # keeps shared edges shared instead of opening gaps and slivers between neighbours
+    frames = []
+
+    for tolerance in tolerances:
+        for year in sorted(gdf["year"].unique()):
+            gdf_year = gdf[gdf["year"] == year].copy()
+
+            if tolerance > 0:
+                geometry = gdf_year.geometry.to_crs(3414)
+                simplified = shapely.coverage_simplify(
+                    np.asarray(geometry.values), tolerance
+                )
+                gdf_year["geometry"] = gpd.GeoSeries(
+                    simplified, index=gdf_year.index, crs=3414
+                ).to_crs(gdf.crs)
+
+            gdf_year["tolerance"] = tolerance
+            frames.append(gdf_year)
+
+    # keep the row order of gdf within each tolerance
+    lod = gpd.GeoDataFrame(pd.concat(frames), crs=gdf.crs)
+    lod["row"] = lod.index
+    return lod.sort_values(["tolerance", "row"]).reset_index(drop=True)
+
+
+def process_simplified(gdf=None, use_cache=True):
+    # each year is simplified on its own, so one cache per year; row is the position within the year
+    keys = boundary_keys()
+    frames = []
+
+    for year in keys:
+        name = "simplified_{}".format(year)
+        hashes = {"year": keys[year], "simplify": [SIMPLIFY_VERSION, TOLERANCES]}
+
+        lod_year = read_cache(name, hashes) if use_cache else None
+        if lod_year is None:
+            if gdf is None:
+                gdf = process()
+            lod_year = simplify_boundaries(
+                gdf[gdf["year"] == year].reset_index(drop=True)
+            )
+            write_cache(lod_year, name, hashes)
+        frames.append(lod_year)
+
+    # same order as process() within each tolerance
+    lod = gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), crs=frames[0].crs)
+    return lod.sort_values(["tolerance", "year", "row"]).reset_index(drop=True)
+
+
+def tolerance_for_zoom(zoom, latitude=1.35):
+    # largest tolerance under half a screen pixel at the given web-mercator zoom
+    metres_per_pixel = 156543.03 * math.cos(math.radians(latitude)) / 2**zoom
+    return max(t for t in TOLERANCES if t <= metres_per_pixel / 2)
+
+
+def simplified_frame(lod, tolerance):
+    # same rows and columns as process(), with geometry at the given tolerance
+    frame = lod[lod["tolerance"] == tolerance]
+    return frame.drop(columns=["tolerance", "row"]).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    process_simplified(use_cache=False)
@@ -0,0 +1,69 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from point_lookup import assign_file
+
+# the first two points are out at sea, the last two in the city centre
+POINTS = "lon,lat,{}\n0,0,{}\n0,0,{}\n103.85,1.29,{}\n103.85,1.29,{}\n"
+
+
+def write_csv(path, column, values):
+    path.write_text(POINTS.format(column, *values))
+    return str(path)
+
+
+def test_csv_column_widening_after_the_first_chunk(tmp_path):
+    # int in the first chunk, float in the second
+    source = write_csv(tmp_path / "in.csv", "value", ["1", "2", "2.5", "3"])
+    output = str(tmp_path / "out.parquet")
+
+    assert assign_file(source, output, chunksize=2) == 4
+
+    table = pq.read_table(output)
+    assert table.column("value").to_pylist() == ["1", "2", "2.5", "3"]
+    assert table.schema.field("ED_DESC_2020").type == pa.string()
+    assert table.column("ED_DESC_2020").to_pylist()[:2] == [None, None]
+    assert None not in table.column("ED_DESC_2020").to_pylist()[2:]
+
+
+def test_csv_column_empty_in_the_first_chunk(tmp_path):
+    source = write_csv(tmp_path / "in.csv", "note", ["", "", "a", "b"])
+    output = str(tmp_path / "out.parquet")
+
+    assign_file(source, output, chunksize=2)
+
+    assert pq.read_table(output).column("note").to_pylist() == [None, None, "a", "b"]
+
+
+def test_parquet_input_keeps_its_column_types(tmp_path):
+    # pandas reads the second chunk's ints as floats because of the null
+    source = str(tmp_path / "in.parquet")
+    pq.write_table(
+        pa.table(
+            {
+                "lon": [0.0, 0.0, 103.85, 103.85],
+                "lat": [0.0, 0.0, 1.29, 1.29],
+                "count": pa.array([1, 2, None, 4], pa.int64()),
+            }
+        ),
+        source,
+    )
+    output = str(tmp_path / "out.parquet")
+
+    assign_file(source, output, chunksize=2)
+
+    table = pq.read_table(output)
+    assert table.schema.field("count").type == pa.int64()
+    assert table.column("count").to_pylist() == [1, 2, None, 4]
+
+
+def test_csv_output_passes_values_through(tmp_path):
+    source = write_csv(tmp_path / "in.csv", "value", ["1", "2", "2.50", "007"])
+    output = str(tmp_path / "out.csv")
+
+    assign_file(source, output, chunksize=2)
+
+    result = pd.read_csv(output, dtype=str)
+    assert result["value"].tolist() == ["1", "2", "2.50", "007"]
+    assert result["ED_DESC_2020"].isna().tolist() == [True, True, False, False]
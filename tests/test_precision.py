@@ -0,0 +1,19 @@
+import shapely
+
+from data_processing import read_boundaries
+from precision import PRECISION_GRID, normalize_geometries, overlap_area
+
+
+def test_normalized_constituencies_of_a_year_do_not_overlap():
+    # measured in SVY21, where the snapping is done
+    raw = read_boundaries("geojson").to_crs(3414)
+    for year, frame in raw.groupby("year"):
+        normalized = normalize_geometries(frame.geometry)
+        assert overlap_area(normalized) == 0, year
+
+
+def test_normalized_vertices_are_on_the_grid():
+    raw = read_boundaries("geojson").to_crs(3414)
+    coordinates = shapely.get_coordinates(normalize_geometries(raw.geometry).values)
+    steps = coordinates / PRECISION_GRID
+    assert abs(steps - steps.round()).max() < 1e-6
@@ -0,0 +1,111 @@
+import threading
+
+import geopandas as gpd
+import pandas as pd
+import shapely
+from streamlit_folium import _get_map_string
+
+from map_cache import MapCache
+from topology import build_topology
+from views import (
+    assemble_panels,
+    layer,
+    map_spec,
+    metric_colormap,
+    metric_layer,
+    prepare_panels,
+    retained_size,
+)
+
+
+def boundaries():
+    # a row of four square constituencies in each of two years, about 1 km wide
+    rows = []
+    for year in ["2015", "2020"]:
+        for i in range(4):
+            rows.append(
+                {
+                    "year": year,
+                    "ED_DESC": "ED {}".format(i),
+                    "constituency_type": "SMC",
+                    "pax_number": 1,
+                    "result": "PAP",
+                    "geometry": shapely.box(
+                        103.8 + 0.01 * i, 1.3, 103.81 + 0.01 * i, 1.31
+                    ),
+                }
+            )
+    return gpd.GeoDataFrame(rows, crs=4326)
+
+
+def view(gdf):
+    # a metric-coloured topology map with a legend, and a plain GeoJSON map
+    compactness = pd.DataFrame(
+        {
+            "year": gdf["year"],
+            "ED_DESC": gdf["ED_DESC"],
+            "polsby_popper": [0.1 * (i + 1) for i in range(len(gdf))],
+        }
+    )
+    topology = build_topology(gdf)
+    year = gdf[gdf["year"] == "2020"]
+    return [
+        {
+            "text": "metric",
+            "map": map_spec(
+                year,
+                [metric_layer(topology, "2020", compactness, "polsby_popper")],
+                "map1",
+                legend=metric_colormap(compactness, "polsby_popper"),
+            ),
+        },
+        {
+            "text": "geojson",
+            "map": map_spec(year, [layer(year, color="red")], "map2"),
+        },
+    ]
+
+
+def test_concurrent_renders_of_a_cached_view():
+    # st_folium renders the map it is given and rewrites its element ids, so sessions
+    # showing the same cached view at once must not share a folium.Map
+    gdf = boundaries()
+    cache = MapCache()
+    errors = []
+    scripts = set()
+    lock = threading.Lock()
+
+    def session():
+        try:
+            for _ in range(20):
+                prepared = cache.get(
+                    "view",
+                    lambda: prepare_panels(view(gdf), "CartoDB positron"),
+                    retained_size,
+                )
+                for panel in assemble_panels(prepared):
+                    panel["map"].render()
+                    script = _get_map_string(panel["map"])
+                    panel["map"].get_bounds()
+                    with lock:
+                        scripts.add((panel["key"], script))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=session) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    # every session got the same page for each map
+    assert sorted(key for key, _ in scripts) == ["map1", "map2"]
+
+
+def test_prepared_view_is_not_modified_by_rendering():
+    prepared = prepare_panels(view(boundaries()), "CartoDB positron")
+    before = repr(prepared)
+    for panel in assemble_panels(prepared):
+        panel["map"].get_root().render()
+    assert repr(prepared) == before
@@ -0,0 +1,259 @@
+import numpy as np
+import shapely
+from pyproj import Transformer
+
+from data_processing import boundary_keys, process, read_json_cache, write_json_cache
+from simplify_boundaries import TOLERANCES
+
+TOPOLOGY_VERSION = 1
+
+# grid size for quantized coordinates; about 0.5 m over Singapore's extent
+QUANTIZATION = 100000
+
+PROPERTIES = ["year", "ED_DESC", "constituency_type", "pax_number", "result"]
+
+
+def quantize(gdf, quantization=QUANTIZATION):
+    # integer grid covering all years, as in a TopoJSON transform
+    x0, y0, x1, y1 = gdf.total_bounds
+    kx = (x1 - x0) / (quantization - 1)
+    ky = (y1 - y0) / (quantization - 1)
+    return {"scale": [kx, ky], "translate": [x0, y0]}
+
+
+def polygon_rings(geometry, transform):
+    # quantized rings of every polygon, without the closing point or repeated vertices
+    (kx, ky), (x0, y0) = transform["scale"], transform["translate"]
+    polygons = []
+
+    for polygon in shapely.get_parts(geometry):
+        rings = []
+        for ring in [polygon.exterior, *polygon.interiors]:
+            coords = np.asarray(ring.coords)[:-1]
+            points = np.column_stack(
+                [np.round((coords[:, 0] - x0) / kx), np.round((coords[:, 1] - y0) / ky)]
+            ).astype(np.int64)
+
+            keep = np.any(points != np.roll(points, 1, axis=0), axis=1)
+            points = [tuple(p) for p in points[keep].tolist()]
+            if len(points) >= 3:
+                rings.append(points)
+        if rings:
+            polygons.append(rings)
+
+    return polygons
+
+
+def find_junctions(rings):
+    # a vertex is a junction where the rings passing through it stop running alongside each other,
+    # i.e. it is seen with more than one pair of neighbours
+    neighbours = {}
+    junctions = set()
+
+    for ring in rings:
+        n = len(ring)
+        for i, point in enumerate(ring):
+            pair = frozenset((ring[i - 1], ring[(i + 1) % n]))
+            seen = neighbours.setdefault(point, pair)
+            if seen != pair:
+                junctions.add(point)
+
+    return junctions
+
+
+def cut_ring(ring, junctions):
+    # split a ring into arcs at its junctions; a ring without junctions is one closed arc
+    cuts = [i for i, point in enumerate(ring) if point in junctions]
+
+    if not cuts:
+        start = ring.index(min(ring))
+        ring = ring[start:] + ring[:start]
+        return [ring + [ring[0]]]
+
+    ring = ring[cuts[0] :] + ring[: cuts[0]]
+    cuts = [i - cuts[0] for i in cuts] + [len(ring)]
+    ring = ring + [ring[0]]
+    return [ring[a : b + 1] for a, b in zip(cuts[:-1], cuts[1:])]
+
+
+def closed_arc_key(arc):
+    # closed arcs match regardless of where the ring starts
+    ring = arc[:-1]
+    start = ring.index(min(ring))
+    return tuple(ring[start:] + ring[:start])
+
+
+def simplify_arcs(arcs, transform, tolerance):
+    # simplify every arc in metres (EPSG:3414); arc endpoints are junctions and are always kept,
+    # so neighbouring polygons stay stitched to the same simplified edge
+    (kx, ky), (x0, y0) = transform["scale"], transform["translate"]
+    to_svy21 = Transformer.from_crs(4326, 3414, always_xy=True)
+    to_wgs84 = Transformer.from_crs(3414, 4326, always_xy=True)
+
+    points = np.concatenate([np.asarray(arc, dtype=float) for arc in arcs])
+    offsets = np.repeat(np.arange(len(arcs)), [len(arc) for arc in arcs])
+    x, y = to_svy21.transform(points[:, 0] * kx + x0, points[:, 1] * ky + y0)
+
+    lines = shapely.simplify(
+        shapely.linestrings(np.column_stack([x, y]), indices=offsets), tolerance
+    )
+
+    coords, index = shapely.get_coordinates(lines, return_index=True)
+    lon, lat = to_wgs84.transform(coords[:, 0], coords[:, 1])
+    quantized = np.column_stack(
+        [np.round((lon - x0) / kx), np.round((lat - y0) / ky)]
+    ).astype(np.int64)
+
+    splits = np.cumsum(np.bincount(index, minlength=len(arcs)))[:-1]
+    return [arc.tolist() for arc in np.split(quantized, splits)]
+
+
+def build_topology(gdf, tolerance=0, quantization=QUANTIZATION):
+    # one TopoJSON topology for all years; edges shared between neighbours or between years
+    # are stored once as arcs, and each year is a GeometryCollection object referencing them
+    gdf = gdf.reset_index(drop=True)
+    transform = quantize(gdf, quantization)
+    features = [polygon_rings(geometry, transform) for geometry in gdf.geometry]
+
+    junctions = find_junctions(
+        ring for polygons in features for rings in polygons for ring in rings
+    )
+
+    arcs = []
+    arc_ids = {}
+
+    def arc_index(arc):
+        closed = arc[0] == arc[-1]
+        key = closed_arc_key(arc) if closed else tuple(arc)
+        reverse = arc[::-1]
+        reverse_key = closed_arc_key(reverse) if closed else tuple(reverse)
+
+        if key in arc_ids:
+            return arc_ids[key]
+        if reverse_key in arc_ids:
+            return ~arc_ids[reverse_key]
+
+        arc_ids[key] = len(arcs)
+        arcs.append(arc)
+        return arc_ids[key]
+
+    # plain python values so the properties serialize as JSON
+    records = gdf[PROPERTIES].astype(object).to_dict("records")
+
+    geometries = {}
+    for properties, polygons in zip(records, features):
+        polygon_arcs = [
+            [[arc_index(arc) for arc in cut_ring(ring, junctions)] for ring in rings]
+            for rings in polygons
+        ]
+
+        geometry = {"properties": properties}
+        if len(polygon_arcs) == 1:
+            geometry.update({"type": "Polygon", "arcs": polygon_arcs[0]})
+        else:
+            geometry.update({"type": "MultiPolygon", "arcs": polygon_arcs})
+
+        geometries.setdefault(properties["year"], []).append(geometry)
+
+    if tolerance > 0:
+        arcs = simplify_arcs(arcs, transform, tolerance)
+
+    # delta-encode each arc, as TopoJSON expects for quantized topologies
+    encoded = []
+    for arc in arcs:
+        points = np.asarray(arc, dtype=np.int64)
+        points[1:] = np.diff(points, axis=0)
+        encoded.append(points.tolist())
+
+    return {
+        "type": "Topology",
+        "transform": transform,
+        "objects": {
+            year: {"type": "GeometryCollection", "geometries": geometries[year]}
+            for year in sorted(geometries)
+        },
+        "arcs": encoded,
+    }
+
+
+def object_arcs(topology, year):
+    # arc ids referenced by one year's object, ignoring direction
+    ids = set()
+
+    def collect(arcs):
+        for item in arcs:
+            if isinstance(item, list):
+                collect(item)
+            else:
+                ids.add(item if item >= 0 else ~item)
+
+    for geometry in topology["objects"][year]["geometries"]:
+        collect(geometry["arcs"])
+
+    return ids
+
+
+def boundary_diff(topology, year, other_year):
+    # boundary edges only in year, only in other_year, and unchanged between the two
+    arcs = object_arcs(topology, year)
+    other_arcs = object_arcs(topology, other_year)
+    return arcs - other_arcs, other_arcs - arcs, arcs & other_arcs
+
+
+def subset_topology(topology, years):
+    # standalone topology holding only the given years' objects and the arcs they use
+    years = [years] if isinstance(years, str) else list(years)
+    used = sorted(set().union(*[object_arcs(topology, year) for year in years]))
+    remap = {old: new for new, old in enumerate(used)}
+
+    def rewrite(arcs):
+        return [
+            (
+                rewrite(item)
+                if isinstance(item, list)
+                else (remap[item] if item >= 0 else ~remap[~item])
+            )
+            for item in arcs
+        ]
+
+    objects = {}
+    for year in years:
+        objects[year] = {
+            "type": "GeometryCollection",
+            "geometries": [
+                dict(geometry, arcs=rewrite(geometry["arcs"]))
+                for geometry in topology["objects"][year]["geometries"]
+            ],
+        }
+
+    return {
+        "type": "Topology",
+        "transform": topology["transform"],
+        "objects": objects,
+        "arcs": [topology["arcs"][i] for i in used],
+    }
+
+
+def process_topology(tolerance=0, gdf=None, use_cache=True):
+    hashes = boundary_keys()
+    hashes["topology"] = [TOPOLOGY_VERSION, QUANTIZATION, tolerance]
+    name = "topology_{}m".format(tolerance)
+
+    if use_cache:
+        topology = read_json_cache(name, hashes)
+        if topology is not None:
+            return topology
+
+    if gdf is None:
+        gdf = process()
+
+    topology = build_topology(gdf, tolerance)
+    write_json_cache(topology, name, hashes)
+
+    return topology
+
+
+if __name__ == "__main__":
+    gdf = process()
+    for tolerance in TOLERANCES:
+        process_topology(tolerance, gdf, use_cache=False)
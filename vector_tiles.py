@@ -0,0 +1,407 @@
+import gzip
+import http.server
+import itertools
+import math
+import os
+import re
+import sqlite3
+import struct
+import threading
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from compactness import METRICS, process_compactness
+from compute_overlay import OVERLAY_VERSION, process_overlay
+from data_processing import CACHE_DIR, boundary_keys, process
+
+TILES_VERSION = 1
+TILES_FILE = os.path.join(CACHE_DIR, "tiles.mbtiles")
+
+# zoom pyramid; the map overzooms the level-14 tiles (~2.4 km across) past MAX_ZOOM
+MIN_ZOOM = 10
+MAX_ZOOM = 14
+
+# tile coordinate units per tile, and how far geometries run past the tile edge so
+# strokes do not show seams
+EXTENT = 4096
+BUFFER = 64
+
+# half the width of the web mercator plane, in metres
+ORIGIN = 20037508.342789244
+
+BOUNDARY_PROPERTIES = [
+    "year",
+    "ED_DESC",
+    "constituency_type",
+    "pax_number",
+    "result",
+] + list(METRICS)
+
+# a fragment is drawn under the name of the other year's constituency it falls in,
+# and `constituency` is the one it was cut from
+FRAGMENT_PROPERTIES = [
+    "year",
+    "ED_DESC",
+    "constituency",
+    "constituency_type",
+    "pax_number",
+    "result",
+    "area_km2",
+    "share_pct",
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS tilesets (name TEXT PRIMARY KEY, key TEXT);
+CREATE TABLE IF NOT EXISTS tiles (
+    tileset TEXT,
+    zoom_level INTEGER,
+    tile_column INTEGER,
+    tile_row INTEGER,
+    tile_data BLOB,
+    PRIMARY KEY (tileset, zoom_level, tile_column, tile_row)
+);
+"""
+
+
+# minimal protobuf writer for the Mapbox Vector Tile 2.1 schema
+def varint(value):
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 31)
+
+
+def field(number, wire_type):
+    return varint((number << 3) | wire_type)
+
+
+def length_delimited(number, payload):
+    return field(number, 2) + varint(len(payload)) + payload
+
+
+def packed(number, values):
+    return length_delimited(number, b"".join(varint(v) for v in values))
+
+
+def encode_value(value):
+    # Value message: string, double, sint or bool
+    if isinstance(value, (bool, np.bool_)):
+        return field(7, 0) + varint(int(value))
+    if isinstance(value, (int, np.integer)):
+        return field(6, 0) + varint((int(value) << 1) ^ (int(value) >> 63))
+    if isinstance(value, (float, np.floating)):
+        return field(3, 1) + struct.pack("<d", value)
+    return length_delimited(1, str(value).encode())
+
+
+def ring_commands(ring, exterior, cursor):
+    # MoveTo, LineTo and ClosePath for one ring already in tile coordinates; exterior rings
+    # wind with positive area in tile space (y down), holes negative; rings that collapse
+    # at this zoom are dropped
+    ring = np.rint(ring[:-1]).astype(np.int64)
+    if len(ring) == 0:
+        return []
+    keep = np.any(ring != np.roll(ring, 1, axis=0), axis=1)
+    ring = ring[keep] if keep.any() else ring[:1]
+    if len(ring) < 3:
+        return []
+
+    x, y = ring[:, 0], ring[:, 1]
+    area = np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y)
+    if area == 0:
+        return []
+    if (area > 0) != exterior:
+        ring = ring[::-1]
+
+    deltas = np.diff(np.vstack([cursor, ring]), axis=0)
+    cursor[:] = ring[-1]
+
+    commands = [
+        (1 & 7) | (1 << 3),
+        zigzag(int(deltas[0, 0])),
+        zigzag(int(deltas[0, 1])),
+    ]
+    commands.append((2 & 7) | ((len(ring) - 1) << 3))
+    for dx, dy in deltas[1:]:
+        commands.extend([zigzag(int(dx)), zigzag(int(dy))])
+    commands.append((7 & 7) | (1 << 3))
+    return commands
+
+
+def polygon_commands(geometry):
+    cursor = np.zeros(2, dtype=np.int64)
+    commands = []
+    for polygon in shapely.get_parts(geometry):
+        if not isinstance(polygon, shapely.Polygon):
+            continue
+        shell = ring_commands(np.asarray(polygon.exterior.coords)[:, :2], True, cursor)
+        if not shell:
+            continue
+        commands.extend(shell)
+        for hole in polygon.interiors:
+            commands.extend(
+                ring_commands(np.asarray(hole.coords)[:, :2], False, cursor)
+            )
+    return commands
+
+
+def encode_tile(name, geometries, properties):
+    # one-layer tile of polygon features; properties is a list of dicts, one per geometry
+    keys, values = {}, {}
+    features = []
+
+    for geometry, props in zip(geometries, properties):
+        commands = polygon_commands(geometry)
+        if not commands:
+            continue
+
+        tags = []
+        for key, value in props.items():
+            if value is None or (isinstance(value, float) and math.isnan(value)):
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault(encode_value(value), len(values)))
+
+        features.append(packed(2, tags) + field(3, 0) + varint(3) + packed(4, commands))
+
+    if not features:
+        return None
+
+    layer = (
+        field(15, 0)
+        + varint(2)
+        + length_delimited(1, name.encode())
+        + b"".join(length_delimited(2, feature) for feature in features)
+        + b"".join(length_delimited(3, key.encode()) for key in keys)
+        + b"".join(length_delimited(4, value) for value in values)
+        + field(5, 0)
+        + varint(EXTENT)
+    )
+    return gzip.compress(length_delimited(3, layer), mtime=0)
+
+
+def tile_size(zoom):
+    return 2 * ORIGIN / 2**zoom
+
+
+def tile_range(bounds, zoom):
+    # x and y tile indices covering web mercator bounds (minx, miny, maxx, maxy)
+    size = tile_size(zoom)
+    x0 = int((bounds[0] + ORIGIN) // size)
+    x1 = int((bounds[2] + ORIGIN) // size)
+    y0 = int((ORIGIN - bounds[3]) // size)
+    y1 = int((ORIGIN - bounds[1]) // size)
+    return range(x0, x1 + 1), range(y0, y1 + 1)
+
+
+def build_tileset(name, gdf, columns):
+    # every tile of one tileset across the zoom pyramid, as (zoom, x, y, data);
+    # geometries are simplified to one tile unit at each zoom, then clipped per tile
+    geometry = np.asarray(gdf.geometry.to_crs(3857).values)
+    records = (
+        gdf[columns].astype(object).where(gdf[columns].notna(), None).to_dict("records")
+    )
+    bounds = shapely.total_bounds(geometry)
+
+    for zoom in range(MIN_ZOOM, MAX_ZOOM + 1):
+        size = tile_size(zoom)
+        simplified = shapely.simplify(geometry, size / EXTENT)
+        tree = shapely.STRtree(simplified)
+        margin = size * BUFFER / EXTENT
+
+        xs, ys = tile_range(bounds, zoom)
+        for x, y in itertools.product(xs, ys):
+            minx = x * size - ORIGIN
+            maxy = ORIGIN - y * size
+            clip = (
+                minx - margin,
+                maxy - size - margin,
+                minx + size + margin,
+                maxy + margin,
+            )
+
+            idx = np.sort(tree.query(shapely.box(*clip), predicate="intersects"))
+            if len(idx) == 0:
+                continue
+
+            clipped = shapely.transform(
+                shapely.clip_by_rect(simplified[idx], *clip),
+                lambda c: np.column_stack(
+                    [(c[:, 0] - minx) / size * EXTENT, (maxy - c[:, 1]) / size * EXTENT]
+                ),
+            )
+            data = encode_tile(name, clipped, [records[i] for i in idx])
+            if data is not None:
+                yield zoom, x, y, data
+
+
+def boundary_tileset(gdf, compactness, year):
+    boundaries = gdf[gdf["year"] == year].merge(
+        compactness[["year", "ED_DESC"] + list(METRICS)].round(3),
+        how="left",
+        on=["year", "ED_DESC"],
+    )
+    return boundaries, BOUNDARY_PROPERTIES
+
+
+def fragment_tileset(gdf, overlay, year, other_year):
+    # pieces of each `year` constituency labelled with the `other_year` constituency they fall in,
+    # as in views.fragments_with_info
+    fragments = overlay.loc[(year, other_year)].reset_index(drop=True)
+    fragments = fragments[fragments["ED_DESC"] != fragments["other_ED_DESC"]]
+    info = gdf.loc[
+        gdf["year"] == other_year,
+        ["year", "ED_DESC", "constituency_type", "pax_number", "result"],
+    ]
+    fragments = gpd.GeoDataFrame(
+        {
+            "ED_DESC": fragments["other_ED_DESC"].to_numpy(),
+            "constituency": fragments["ED_DESC"].to_numpy(),
+            "area_km2": (fragments["area"] / 1e6).round(3).to_numpy(),
+            "share_pct": (100 * fragments["share"]).round(1).to_numpy(),
+        },
+        geometry=fragments.geometry.to_numpy(),
+        crs=overlay.crs,
+    ).merge(info, how="left", on="ED_DESC")
+    return fragments, FRAGMENT_PROPERTIES
+
+
+def boundaries_name(year):
+    return "boundaries_{}".format(year)
+
+
+def changes_name(year, other_year):
+    return "changes_{}_{}".format(year, other_year)
+
+
+def process_tiles(gdf=None, overlay=None, compactness=None, path=TILES_FILE):
+    # one archive holding a tileset per year's boundaries and per ordered year pair's
+    # change fragments; a tileset is retiled only when the years it uses change
+    keys = boundary_keys()
+    tilesets = {boundaries_name(year): (year,) for year in keys} | {
+        changes_name(year, other_year): (year, other_year)
+        for year, other_year in itertools.permutations(keys, 2)
+    }
+    wanted = {
+        name: "{}:{}:{}".format(
+            TILES_VERSION, OVERLAY_VERSION, ",".join(keys[y] for y in years)
+        )
+        for name, years in tilesets.items()
+    }
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with sqlite3.connect(path) as db:
+        db.executescript(SCHEMA)
+        stored = dict(db.execute("SELECT name, key FROM tilesets"))
+
+        # tilesets of years no longer in data/
+        for name in set(stored) - set(wanted):
+            db.execute("DELETE FROM tiles WHERE tileset = ?", (name,))
+            db.execute("DELETE FROM tilesets WHERE name = ?", (name,))
+
+        for name, years in tilesets.items():
+            if stored.get(name) == wanted[name]:
+                continue
+
+            if gdf is None:
+                gdf = process()
+            if len(years) == 1:
+                if compactness is None:
+                    compactness = process_compactness(gdf)
+                frame, columns = boundary_tileset(gdf, compactness, *years)
+            else:
+                if overlay is None:
+                    overlay = process_overlay(gdf)
+                frame, columns = fragment_tileset(gdf, overlay, *years)
+
+            db.execute("DELETE FROM tiles WHERE tileset = ?", (name,))
+            db.executemany(
+                "INSERT INTO tiles VALUES (?, ?, ?, ?, ?)",
+                (
+                    (name, zoom, x, y, data)
+                    for zoom, x, y, data in build_tileset(name, frame, columns)
+                ),
+            )
+            db.execute(
+                "INSERT OR REPLACE INTO tilesets VALUES (?, ?)", (name, wanted[name])
+            )
+            # one transaction per tileset, so an interrupted build keeps the finished ones
+            db.commit()
+
+        db.executemany(
+            "INSERT OR REPLACE INTO metadata VALUES (?, ?)",
+            [
+                ("format", "pbf"),
+                ("minzoom", str(MIN_ZOOM)),
+                ("maxzoom", str(MAX_ZOOM)),
+                ("scheme", "xyz"),
+            ],
+        )
+
+    return path
+
+
+# /<tileset>/<z>/<x>/<y>.pbf
+TILE_PATH = re.compile(r"^/(\w+)/(\d+)/(\d+)/(\d+)\.pbf$")
+
+
+class TileHandler(http.server.BaseHTTPRequestHandler):
+    # serves gzipped tiles straight from the archive; empty tiles are 204
+    path_to_archive = TILES_FILE
+
+    def do_GET(self):
+        match = TILE_PATH.match(self.path.split("?")[0])
+        if match is None:
+            self.send_error(404)
+            return
+
+        tileset, zoom, x, y = match.groups()
+        # sqlite connections are per thread, and each request runs in its own
+        with sqlite3.connect(
+            "file:{}?mode=ro".format(self.path_to_archive), uri=True
+        ) as db:
+            row = db.execute(
+                "SELECT tile_data FROM tiles WHERE tileset = ? AND zoom_level = ?"
+                " AND tile_column = ? AND tile_row = ?",
+                (tileset, int(zoom), int(x), int(y)),
+            ).fetchone()
+
+        # the map is served from another origin (the Streamlit component iframe)
+        self.send_response(200 if row else 204)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Cache-Control", "public, max-age=3600")
+        if row:
+            self.send_header("Content-Type", "application/x-protobuf")
+            self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(row[0])))
+        self.end_headers()
+        if row:
+            self.wfile.write(row[0])
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_tile_server(path=TILES_FILE, host="127.0.0.1", port=0):
+    # serve the archive from a daemon thread; returns the URL template for one tileset,
+    # with {tileset} left to fill in and {z}/{x}/{y} left for the map
+    handler = type("ArchiveTileHandler", (TileHandler,), {"path_to_archive": path})
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return "http://{}:{}/{{tileset}}/{{{{z}}}}/{{{{x}}}}/{{{{y}}}}.pbf".format(
+        host, server.server_address[1]
+    )
+
+
+if __name__ == "__main__":
+    process_tiles()
@@ -0,0 +1,661 @@
+import copy
+import json
+
+import branca.colormap
+import folium
+import geopandas as gpd
+import numpy as np
+import orjson
+from branca.element import Template
+from folium.features import GeoJsonTooltip
+from folium.plugins import VectorGridProtobuf
+from folium.template import Template as FoliumTemplate
+
+from compact_geojson import COORDINATE_PRECISION, html_safe, to_geojson
+from compactness import METRICS
+from compute_overlay import get_fragments
+from topology import subset_topology
+from vector_tiles import MAX_ZOOM, MIN_ZOOM, boundaries_name, changes_name
+
+COMPARE_TYPES = [
+    "Full Map",
+    "Constituency Year vs Year",
+    "Constituency Changes Year over Year",
+]
+
+INFO_COLUMNS = ["year", "ED_DESC", "constituency_type", "pax_number", "result"]
+
+# a constituency missing from one year is shown as the other year's constituencies
+# that hold at least this share of its area
+LINEAGE_MIN_SHARE = 0.1
+
+# memory held by a prepared map besides its layer payloads; measured with tracemalloc
+# at 2-6 KB for the full maps and constituency views
+PREPARED_MAP_BYTES = 8 * 1024
+
+# overlay fragments also carry the area moved between the two constituencies
+FRAGMENT_COLUMNS = INFO_COLUMNS + ["area_km2", "share_pct"]
+
+ALIASES = {
+    "year": "Year: ",
+    "ED_DESC": "ED: ",
+    "constituency_type": "Type: ",
+    "pax_number": "Pax: ",
+    "result": "Result: ",
+    "area_km2": "Area (km²): ",
+    "share_pct": "Share of constituency (%): ",
+    **{metric: "{}: ".format(name) for metric, name in METRICS.items()},
+}
+
+
+def make_tooltip(fields=INFO_COLUMNS):
+    return GeoJsonTooltip(
+        fields=fields,
+        aliases=[ALIASES[field] for field in fields],
+        localize=True,
+        sticky=True,
+        labels=True,
+        style="""
+        background-color: #F0EFEF;
+        border: 2px solid black;
+        border-radius: 3px;
+        box-shadow: 3px;
+    """,
+        max_width=300,
+    )
+
+
+def map_spec(gdf_center, layers, key, zoom_start=12, legend=None):
+    # everything needed to draw one map; centred on the mean centroid of gdf_center
+    return {
+        "location": [
+            gdf_center.geometry.centroid.y.mean(),
+            gdf_center.geometry.centroid.x.mean(),
+        ],
+        "zoom_start": zoom_start,
+        "layers": layers,
+        "key": key,
+        "legend": legend,
+    }
+
+
+def layer(data, topology_object=None, fields=INFO_COLUMNS, **kwargs):
+    # data is a GeoDataFrame, or a topology when topology_object names the year to draw
+    return {
+        "data": data,
+        "topology_object": topology_object,
+        "fields": fields,
+        "kwargs": kwargs,
+    }
+
+
+def tile_layer(tile_url, tileset, fields=INFO_COLUMNS, style="{}", constituency=None):
+    # layer drawn from the vector tile server; style is a JS expression for the Leaflet path
+    # options of a feature with `properties`, and with a constituency only the fragments
+    # cut from it are drawn
+    condition = "true"
+    if constituency is not None:
+        condition = "properties.constituency === {}".format(json.dumps(constituency))
+    return {
+        "url": tile_url.format(tileset=tileset),
+        "tileset": tileset,
+        "fields": fields,
+        "style": "function(properties, zoom) {{ return {} ? {} : []; }}".format(
+            condition, style
+        ),
+    }
+
+
+class VectorTileLayer(VectorGridProtobuf):
+    # VectorGridProtobuf with the tooltip fields shown in a popup when a feature is clicked
+    _template = Template("""
+        {% macro script(this, kwargs) -%}
+        var {{ this.get_name() }} = L.vectorGrid.protobuf(
+            {{ this.url|tojson }}, {{ this.options }}
+        );
+        {{ this.get_name() }}.on("click", function(e) {
+            var properties = e.layer.properties;
+            var rows = {{ this.fields|tojson }}.map(function(field) {
+                return "<b>" + field[1] + "</b>" + (properties[field[0]] ?? "");
+            });
+            L.popup()
+                .setLatLng(e.latlng)
+                .setContent(rows.join("<br>"))
+                .openOn({{ this._parent.get_name() }});
+        });
+        {%- endmacro %}
+        """)
+
+    def __init__(self, url, name, fields, style):
+        # tiles exist for MIN_ZOOM..MAX_ZOOM and are scaled outside that range
+        options = (
+            "{{rendererFactory: L.canvas.tile, interactive: true, "
+            "minNativeZoom: {}, maxNativeZoom: {}, "
+            "vectorTileLayerStyles: {{{}: {}}}}}".format(
+                MIN_ZOOM, MAX_ZOOM, json.dumps(name), style
+            )
+        )
+        super().__init__(url, name, options)
+        self.fields = [[field, ALIASES[field]] for field in fields]
+
+
+def geojson_layer(gdf, fields, precision=COORDINATE_PRECISION):
+    # what a CompactGeoJson layer needs, made once: the compact GeoJSON text, each feature's
+    # tooltip properties without its geometry, and the bounds
+    if gdf.crs is not None and not gdf.crs.equals(4326):
+        gdf = gdf.to_crs(4326)
+
+    xmin, ymin, xmax, ymax = gdf.total_bounds
+    return {
+        "payload": html_safe(to_geojson(gdf, fields, precision)).decode(),
+        "properties": [
+            dict(zip(fields, values))
+            for values in zip(*[gdf[field].tolist() for field in fields])
+        ],
+        "bounds": [[ymin, xmin], [ymax, xmax]],
+    }
+
+
+def topojson_layer(topology, object_name, style_function=None):
+    # what a CompactTopoJson layer needs, made once: the topology text with the style
+    # function applied up front, the first geometry's properties and the bounds
+    style_function = style_function or (lambda feature: {})
+    geometries = [
+        dict(
+            geometry,
+            properties=dict(geometry["properties"], style=style_function(geometry)),
+        )
+        for geometry in topology["objects"][object_name]["geometries"]
+    ]
+    objects = {object_name: {"type": "GeometryCollection", "geometries": geometries}}
+
+    # arcs are delta-encoded on the quantized grid
+    points = np.concatenate(
+        [np.cumsum(np.asarray(arc), axis=0) for arc in topology["arcs"]]
+    )
+    (kx, ky), (x0, y0) = (
+        topology["transform"]["scale"],
+        topology["transform"]["translate"],
+    )
+    (xmin, ymin), (xmax, ymax) = points.min(axis=0), points.max(axis=0)
+    return {
+        "payload": html_safe(
+            orjson.dumps(
+                dict(topology, objects=objects), option=orjson.OPT_SERIALIZE_NUMPY
+            )
+        ).decode(),
+        "object_name": object_name,
+        "properties": geometries[0]["properties"],
+        "bounds": [
+            [y0 + ky * ymin, x0 + kx * xmin],
+            [y0 + ky * ymax, x0 + kx * xmax],
+        ],
+    }
+
+
+class CompactGeoJson(folium.GeoJson):
+    # GeoJson layer embedding geojson_layer's text as it is, instead of folium dumping a
+    # dict again; folium itself only gets each feature's properties, for the tooltip,
+    # and the bounds
+    _template = FoliumTemplate("""
+        {% macro script(this, kwargs) -%}
+        var {{ this.get_name() }} = L.geoJson(null, {{ this.options|tojavascript }});
+        {{ this.get_name() }}.addData({{ this.payload }});
+        {%- endmacro %}
+        """)
+
+    def __init__(self, layer, **kwargs):
+        # new feature dicts, since folium may write to them while rendering
+        features = [
+            {"type": "Feature", "properties": dict(properties), "geometry": None}
+            for properties in layer["properties"]
+        ]
+        super().__init__({"type": "FeatureCollection", "features": features}, **kwargs)
+        self.payload = layer["payload"]
+        self.bounds = layer["bounds"]
+
+    def _get_self_bounds(self):
+        return self.bounds
+
+
+class CompactTopoJson(folium.TopoJson):
+    # TopoJson layer embedding topojson_layer's text, styles included; folium's own writes
+    # the styles into the topology and dumps it again on every render. folium itself only
+    # gets the first geometry's properties, for the tooltip checks, and the bounds
+    _template = FoliumTemplate("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }}_data = {{ this.payload }};
+            var {{ this.get_name() }} = L.geoJson(
+                topojson.feature(
+                    {{ this.get_name() }}_data,
+                    {{ this.get_name() }}_data{{ this._safe_object_path }}
+                )
+            ).addTo({{ this._parent.get_name() }});
+            {{ this.get_name() }}.setStyle(function(feature) {
+                return feature.properties.style;
+            });
+        {% endmacro %}
+        """)
+
+    def __init__(self, layer, **kwargs):
+        object_name = layer["object_name"]
+        geometries = [{"properties": dict(layer["properties"])}]
+        super().__init__(
+            {"objects": {object_name: {"geometries": geometries}}},
+            "objects.{}".format(object_name),
+            **kwargs,
+        )
+        self.payload = layer["payload"]
+        self.bounds = layer["bounds"]
+
+    def get_bounds(self):
+        return self.bounds
+
+
+def colormap_js(colormap, steps=64):
+    # JS expression for the colormap's colour of `value`, from `steps` samples of it
+    low, high = colormap.vmin, colormap.vmax
+    colors = [
+        colormap.rgb_hex_str(low + (high - low) * i / (steps - 1)) for i in range(steps)
+    ]
+    return (
+        "{colors}[Math.min({last}, Math.max(0, "
+        "Math.round((value - {low}) / {span} * {last})))]".format(
+            colors=json.dumps(colors), last=steps - 1, low=low, span=(high - low) or 1
+        )
+    )
+
+
+def metric_colormap(compactness, metric):
+    # one scale across all years so colours are comparable between the two maps; red is least compact
+    values = compactness[metric]
+    colormap = branca.colormap.linear.RdYlGn_09.scale(values.min(), values.max())
+    colormap.caption = METRICS[metric]
+    return colormap
+
+
+def metric_layer(topology, year, compactness, metric):
+    # full-map layer of one year coloured by a compactness metric, which is also added to the tooltip
+    topology = subset_topology(topology, year)
+    values = (
+        compactness[compactness["year"] == year]
+        .set_index("ED_DESC")[metric]
+        .round(3)
+        .to_dict()
+    )
+
+    # subset_topology returns new geometry dicts, so the shared properties are copied, not modified
+    for geometry in topology["objects"][year]["geometries"]:
+        properties = geometry["properties"]
+        geometry["properties"] = dict(
+            properties, **{metric: values.get(properties["ED_DESC"])}
+        )
+
+    colormap = metric_colormap(compactness, metric)
+    return layer(
+        topology,
+        year,
+        fields=INFO_COLUMNS + [metric],
+        style_function=lambda feature: {
+            "fillColor": colormap(feature["properties"][metric]),
+            "color": "black",
+            "weight": 1,
+            "fillOpacity": 0.6,
+        },
+    )
+
+
+def fragments_with_info(overlay, gdf_other_all, year, other_year, constituency):
+    # pieces of the constituency in `year` labelled with the `other_year` constituency they fall in
+    fragments = get_fragments(overlay, year, other_year, constituency)
+
+    # convert to geodataframe
+    intersected_gpd = gpd.GeoDataFrame(
+        {
+            "ED_DESC": fragments["other_ED_DESC"],
+            "area_km2": (fragments["area"] / 1e6).round(3),
+            "share_pct": (100 * fragments["share"]).round(1),
+            "geometry": fragments.geometry,
+        },
+        crs="4326",
+    )
+
+    # get constituency info
+    return intersected_gpd.merge(
+        gdf_other_all[INFO_COLUMNS],
+        how="left",
+        on=["ED_DESC"],
+    )
+
+
+def build_view(
+    store,
+    overlay,
+    lineage,
+    topology,
+    baseline_year,
+    compare_year,
+    compare_type,
+    constituency,
+    compactness=None,
+    metric=None,
+    tile_url=None,
+):
+    # text and map for the two columns of the dashboard, for one selection;
+    # frames come from the shared BoundaryStore and are not modified here.
+    # with a metric, the full maps are coloured by that compactness metric.
+    # with a tile_url (vector_tiles.start_tile_server), the full maps and change fragments
+    # are drawn from vector tiles instead of being embedded in the page
+    gdf_baseline = store.constituency_frame(baseline_year, constituency)
+    gdf_compare_all = store.year_frame(compare_year)
+    gdf_compare = store.constituency_frame(compare_year, constituency)
+    gdf_baseline_all = store.year_frame(baseline_year)
+
+    if compare_type == "Full Map":
+        if tile_url is not None:
+            fields, style, legends = INFO_COLUMNS, "{}", [None, None]
+            if metric is not None:
+                colormap = metric_colormap(compactness, metric)
+                fields = INFO_COLUMNS + [metric]
+                style = (
+                    "{{fill: true, fillColor: (function(value) {{ return {}; }})"
+                    '(properties.{}), fillOpacity: 0.6, color: "black", weight: 1}}'
+                ).format(colormap_js(colormap), metric)
+                legends = [colormap, colormap]
+            baseline_layer, compare_layer = [
+                tile_layer(tile_url, boundaries_name(year), fields, style)
+                for year in [baseline_year, compare_year]
+            ]
+        elif metric is None:
+            baseline_layer = layer(
+                subset_topology(topology, baseline_year), baseline_year
+            )
+            compare_layer = layer(subset_topology(topology, compare_year), compare_year)
+            legends = [None, None]
+        else:
+            baseline_layer = metric_layer(topology, baseline_year, compactness, metric)
+            compare_layer = metric_layer(topology, compare_year, compactness, metric)
+            legends = [metric_colormap(compactness, metric) for _ in range(2)]
+
+        left = {
+            "text": "Full Electoral Boundaries for Year {}".format(baseline_year),
+            "map": map_spec(
+                gdf_baseline_all,
+                [baseline_layer],
+                "map2.2",
+                zoom_start=11,
+                legend=legends[0],
+            ),
+        }
+        right = {
+            "text": "Full Electoral Boundaries for Year {}".format(compare_year),
+            "map": map_spec(
+                gdf_compare_all,
+                [compare_layer],
+                "map2.3",
+                zoom_start=11,
+                legend=legends[1],
+            ),
+        }
+        return left, right
+
+    if compare_type == "Constituency Year vs Year":
+        if len(gdf_baseline) == 0 and len(gdf_compare) == 0:
+            left = {
+                "text": "No such constituency in year {}".format(baseline_year),
+                "map": None,
+            }
+            right = {
+                "text": "No such constituency in year {}".format(compare_year),
+                "map": None,
+            }
+            return left, right
+
+        if len(gdf_baseline) == 0:
+            # if the constituency does not exist in baseline year, we find the equivalence of the GRC/SMC
+            predecessors = lineage.related(
+                compare_year, constituency, baseline_year, LINEAGE_MIN_SHARE
+            )
+            old_areas_gpd = gdf_baseline_all[
+                gdf_baseline_all["ED_DESC"].isin(predecessors)
+            ]
+            left = {
+                "text": "No such constituency in year {}. Showing the GRC/SMC that bounded the same area.".format(
+                    baseline_year
+                ),
+                "map": map_spec(old_areas_gpd, [layer(old_areas_gpd)], "map1.1"),
+            }
+        else:
+            left = {
+                "text": "Electoral Boundaries for Year {}".format(baseline_year),
+                "map": map_spec(gdf_baseline, [layer(gdf_baseline)], "map1"),
+            }
+
+        if len(gdf_compare) == 0:
+            successors = lineage.related(
+                baseline_year, constituency, compare_year, LINEAGE_MIN_SHARE
+            )
+            new_areas_gpd = gdf_compare_all[gdf_compare_all["ED_DESC"].isin(successors)]
+            right = {
+                "text": "No such constituency in year {}. Showing the GRC/SMC that bounded the same area.".format(
+                    compare_year
+                ),
+                "map": map_spec(new_areas_gpd, [layer(new_areas_gpd)], "map1.1"),
+            }
+        else:
+            right = {
+                "text": "Electoral Boundaries for Year {}".format(compare_year),
+                "map": map_spec(gdf_compare, [layer(gdf_compare)], "map2.1"),
+            }
+        return left, right
+
+    # Constituency Changes Year over Year
+    if len(gdf_baseline) == 0:
+        left = {
+            "text": "No such constituency in year {}.".format(baseline_year),
+            "map": None,
+        }
+    else:
+        left = {
+            "text": "Electoral Boundaries for Year {}".format(baseline_year),
+            "map": map_spec(gdf_baseline, [layer(gdf_baseline)], "map2.1"),
+        }
+
+    if len(gdf_compare) == 0:
+        right = {
+            "text": "No such constituency in year {}.".format(compare_year),
+            "map": None,
+        }
+    elif len(gdf_baseline) == 0:
+        right = {
+            "text": "Electoral Boundaries for Year {}".format(compare_year),
+            "map": map_spec(gdf_compare, [layer(gdf_compare)], "map2.1"),
+        }
+    elif tile_url is not None:
+        # areas that were removed from, and added to, the baseline constituency
+        right = {
+            "text": "Electoral Boundaries Changes from {} to {}".format(
+                baseline_year, compare_year
+            ),
+            "map": map_spec(
+                gdf_baseline,
+                [
+                    tile_layer(
+                        tile_url,
+                        changes_name(baseline_year, compare_year),
+                        FRAGMENT_COLUMNS,
+                        '{fill: true, color: "red", fillColor: "red", weight: 2}',
+                        constituency,
+                    ),
+                    tile_layer(
+                        tile_url,
+                        changes_name(compare_year, baseline_year),
+                        FRAGMENT_COLUMNS,
+                        '{fill: true, color: "green", fillColor: "green", weight: 2}',
+                        constituency,
+                    ),
+                ],
+                "map2.2",
+            ),
+        }
+    else:
+        # areas that were removed from, and added to, the baseline constituency
+        intersected_gpd = fragments_with_info(
+            overlay, gdf_compare_all, baseline_year, compare_year, constituency
+        )
+        intersected_gpd_added = fragments_with_info(
+            overlay, gdf_baseline_all, compare_year, baseline_year, constituency
+        )
+        right = {
+            "text": "Electoral Boundaries Changes from {} to {}".format(
+                baseline_year, compare_year
+            ),
+            "map": map_spec(
+                gdf_baseline,
+                [
+                    layer(
+                        intersected_gpd,
+                        fields=FRAGMENT_COLUMNS,
+                        name="m1",
+                        color="red",
+                    ),
+                    layer(
+                        intersected_gpd_added,
+                        fields=FRAGMENT_COLUMNS,
+                        name="m2",
+                        color="green",
+                    ),
+                ],
+                "map2.2",
+            ),
+        }
+    return left, right
+
+
+def prepare_map(spec, tiles, precision=COORDINATE_PRECISION):
+    # the costly part of drawing a map, done once: each layer serialized, with GeoDataFrame
+    # layers as compact GeoJSON with coordinates rounded to `precision` decimals and only the
+    # tooltip fields; precision=None leaves them for folium's own conversion.
+    # nothing modifies the result, so it can be shared between sessions, unlike the
+    # folium.Map that assemble_map builds from it
+    layers = []
+    for item in spec["layers"]:
+        if item.get("url"):
+            layers.append(item)
+            continue
+
+        # an empty layer has no properties for the tooltip to bind to; there is nothing to draw anyway
+        if item["topology_object"] is None and len(item["data"]) == 0:
+            continue
+
+        if item["topology_object"] is not None:
+            kwargs = dict(item["kwargs"])
+            prepared = topojson_layer(
+                item["data"],
+                item["topology_object"],
+                kwargs.pop("style_function", None),
+            )
+            layers.append(dict(item, data=None, kwargs=kwargs, topojson=prepared))
+        elif precision is None:
+            layers.append(item)
+        else:
+            prepared = geojson_layer(item["data"], item["fields"], precision)
+            layers.append(dict(item, data=None, geojson=prepared))
+
+    return dict(spec, layers=layers, tiles=tiles)
+
+
+def assemble_map(prepared):
+    # a new folium.Map from prepare_map's output; cheap, since the layers are already
+    # serialized. folium and st_folium write to a map while rendering it, so each render
+    # needs its own
+    m = folium.Map(
+        location=prepared["location"],
+        zoom_start=prepared["zoom_start"],
+        max_zoom=21,
+        tiles=prepared["tiles"],
+    )
+
+    for item in prepared["layers"]:
+        if item.get("url"):
+            VectorTileLayer(
+                item["url"], item["tileset"], item["fields"], item["style"]
+            ).add_to(m)
+        elif item.get("topojson"):
+            CompactTopoJson(
+                item["topojson"], tooltip=make_tooltip(item["fields"]), **item["kwargs"]
+            ).add_to(m)
+        elif item.get("geojson"):
+            CompactGeoJson(
+                item["geojson"], tooltip=make_tooltip(item["fields"]), **item["kwargs"]
+            ).add_to(m)
+        else:
+            folium.GeoJson(
+                item["data"], tooltip=make_tooltip(item["fields"]), **item["kwargs"]
+            ).add_to(m)
+
+    if prepared["legend"] is not None:
+        # the colormap becomes a child of the map, so each map gets its own copy
+        copy.deepcopy(prepared["legend"]).add_to(m)
+
+    return m
+
+
+def render_map(spec, tiles, precision=COORDINATE_PRECISION):
+    return assemble_map(prepare_map(spec, tiles, precision))
+
+
+def prepare_panels(panels, tiles, precision=COORDINATE_PRECISION):
+    # the two panels with their maps prepared; this is what the map cache holds
+    return [
+        {
+            "text": panel["text"],
+            "map": (
+                prepare_map(panel["map"], tiles, precision) if panel["map"] else None
+            ),
+            "key": panel["map"]["key"] if panel["map"] else None,
+        }
+        for panel in panels
+    ]
+
+
+def assemble_panels(prepared):
+    # prepared panels with their maps built, ready to hand to st_folium
+    return [
+        dict(panel, map=assemble_map(panel["map"]) if panel["map"] else None)
+        for panel in prepared
+    ]
+
+
+def render_panels(panels, tiles, precision=COORDINATE_PRECISION):
+    return assemble_panels(prepare_panels(panels, tiles, precision))
+
+
+def rendered_size(rendered):
+    # bytes of HTML the panels render to, which is what the browser is sent
+    return sum(
+        len(panel["map"].get_root().render().encode())
+        for panel in rendered
+        if panel["map"]
+    )
+
+
+def layer_payloads(prepared):
+    # serialized layer text of prepared panels, in bytes
+    return sum(
+        len(item[kind]["payload"])
+        for panel in prepared
+        if panel["map"]
+        for item in panel["map"]["layers"]
+        for kind in ("geojson", "topojson")
+        if item.get(kind)
+    )
+
+
+def retained_size(prepared):
+    # estimated bytes prepared panels keep alive in the cache: the layer payloads plus a
+    # fixed allowance per map for the tooltip properties, bounds and legend. the folium maps
+    # built from them are not counted, since each session's is dropped after its run
+    return layer_payloads(prepared) + PREPARED_MAP_BYTES * sum(
+        1 for panel in prepared if panel["map"]
+    )
@@ -0,0 +1,128 @@
+import itertools
+import queue
+import threading
+from concurrent.futures import Future, wait
+
+from instrumentation import record, stage
+
+# queue priorities, lowest first
+FULL_MAP = 1
+CHANGES = 2
+
+
+class Warmup:
+    # background threads filling a MapCache with views nobody has asked for yet, most
+    # likely first. threads rather than processes, since the prepared views have to end up
+    # in this process's cache.
+    # a live request never queues behind warm-up work: it builds its view in its own
+    # thread, taking over the queued entry if there is one, and the workers hold off
+    # starting anything new until no live build is running
+    def __init__(self, cache, size, workers=1):
+        self.cache = cache
+        self.size = size
+        self.total = 0
+        self.done = 0
+        self.skipped = 0
+        self.failed = 0
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._pending = {}
+        self._live = 0
+        self._lock = threading.Condition()
+        self._threads = [
+            threading.Thread(target=self._work, name="warmup-{}".format(i), daemon=True)
+            for i in range(workers)
+        ]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def submit(self, key, build, priority):
+        # queue one view; a key that is already cached or queued is left alone
+        with self._lock:
+            if key in self._pending or key in self.cache:
+                return
+            future = Future()
+            self._pending[key] = future
+            self.total += 1
+        self._queue.put((priority, next(self._order), key, build, future))
+
+    def _work(self):
+        while True:
+            _, _, key, build, future = self._queue.get()
+            with self._lock:
+                while self._live:
+                    self._lock.wait()
+                # taken over by a live request since it was queued
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if key in self.cache:
+                    self.skipped += 1
+                    self._finish(key, future)
+                    continue
+
+            try:
+                with stage(
+                    "warmup_view", key=key, queued=self._queue.qsize()
+                ) as timing:
+                    value = build()
+                    timing["retained_bytes"] = self.size(value)
+                self.cache.put(key, value, timing["retained_bytes"])
+            except Exception as e:
+                record("warmup_failed", key=key, error=repr(e))
+                with self._lock:
+                    self.failed += 1
+                    self._finish(key, future)
+            else:
+                with self._lock:
+                    self.done += 1
+                    self._finish(key, future)
+
+    def _finish(self, key, future):
+        # called with the lock held
+        del self._pending[key]
+        future.set_result(None)
+        self._lock.notify_all()
+
+    def get(self, key, build):
+        # the view for a live request: from the cache, from the worker already building it,
+        # or built here ahead of everything still queued
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None and future.running():
+                owner = False
+            else:
+                owner = True
+                self._live += 1
+                if future is not None:
+                    # claim the queued entry so no worker starts it
+                    future.cancel()
+                    del self._pending[key]
+                    self.skipped += 1
+
+        if not owner:
+            wait([future])
+            # a failed or evicted warm-up build is simply built again here
+            return self.cache.get(key, build, self.size)
+
+        try:
+            return self.cache.get(key, build, self.size)
+        finally:
+            with self._lock:
+                self._live -= 1
+                self._lock.notify_all()
+
+    def stats(self):
+        with self._lock:
+            running = sum(future.running() for future in self._pending.values())
+            return {
+                "total": self.total,
+                "queued": len(self._pending) - running,
+                "running": running,
+                "done": self.done,
+                "skipped": self.skipped,
+                "failed": self.failed,
+                "live": self._live,
+            }